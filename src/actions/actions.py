@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+
+# Load modules from $CHARM_DIR/lib
+sys.path.append('lib')
+
+from charms.layer import basic
+basic.bootstrap_charm_deps()
+basic.init_config_states()
+
+import charmhelpers.core.hookenv as hookenv
+
+import charm.openstack.aodh as aodh
+import charm.openstack.profiling as profiling
+
+
+def slowest_handlers(args):
+    """Report the slowest handlers recorded by hook profiling."""
+    slowest = profiling.slowest(hookenv.action_get('count'))
+    if not slowest:
+        hookenv.action_fail('No timings recorded; is hook-profiling enabled?')
+        return
+    hookenv.action_set({'slowest': json.dumps(slowest, indent=2)})
+
+
+def benchmark_evaluator(args):
+    """Report the alarm evaluation and notification rates of the unit."""
+    results = aodh.benchmark_evaluator(hookenv.action_get('alarms'),
+                                       hookenv.action_get('cycles'))
+    hookenv.action_set(results)
+
+
+def purge_alarm_history(args):
+    """Delete old alarm history in batches, or resume an interrupted purge.
+    """
+    result = aodh.purge_alarm_history(hookenv.action_get('older-than'),
+                                      hookenv.action_get('batch-size'),
+                                      hookenv.action_get('interval'))
+    hookenv.action_set(result)
+
+
+# Actions to function mapping, to allow for illegal python action names that
+# can map to a python function.
+ACTIONS = {
+    "slowest-handlers": slowest_handlers,
+    "benchmark-evaluator": benchmark_evaluator,
+    "purge-alarm-history": purge_alarm_history,
+}
+
+
+def main(args):
+    action_name = os.path.basename(args[0])
+    try:
+        action = ACTIONS[action_name]
+    except KeyError:
+        return "Action %s undefined" % action_name
+    else:
+        try:
+            action(args)
+        except Exception as e:
+            hookenv.action_fail(str(e))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
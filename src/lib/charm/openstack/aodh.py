@@ -13,23 +13,179 @@
 # limitations under the License.
 
 import collections
+import configparser
+import contextlib
+import datetime
+import functools
+import hashlib
+import json
 import os
+import re
 import subprocess
+import time
+import urllib.parse
 
+import charmhelpers.core.hookenv as hookenv
 import charmhelpers.core.host as ch_host
-import charmhelpers.contrib.charmsupport.nrpe as nrpe
-
+import charmhelpers.core.templating as ch_templating
+import charmhelpers.core.unitdata as unitdata
+import charmhelpers.fetch as ch_fetch
+import charmhelpers.contrib.hahelpers.cluster as ch_cluster
+import charmhelpers.contrib.network.ip as ch_ip
+import charmhelpers.contrib.openstack.templating as ch_os_templating
+import charmhelpers.contrib.openstack.utils as ch_os_utils
+
+import charms.reactive as reactive
+
+# Needed to define and register the release classes: their bases, the
+# config_property and profiling decorators and the api_ports keys
 import charms_openstack.charm
 import charms_openstack.adapters
 import charms_openstack.ip as os_ip
 import charms_openstack.plugins
 
+import charm.openstack.profiling as profiling
+from charm.openstack.lazy import lazy_import
+
+# Only needed by a few handlers, so kept off the start up path of every hook
+nrpe = lazy_import('charmhelpers.contrib.charmsupport.nrpe')
+psutil = lazy_import('psutil')
+urllib_request = lazy_import('urllib.request')
+
 AODH_DIR = '/etc/aodh'
 AODH_CONF = os.path.join(AODH_DIR, 'aodh.conf')
 AODH_API_SYSTEMD_CONF = (
     '/etc/systemd/system/aodh-api.service.d/override.conf'
 )
 AODH_WSGI_CONF = '/etc/apache2/sites-available/aodh-api.conf'
+AODH_EXPIRER_SERVICE = '/etc/systemd/system/aodh-expirer.service'
+AODH_EXPIRER_TIMER = '/etc/systemd/system/aodh-expirer.timer'
+# Runs aodh-expirer batch after batch, recording the duration and rows of
+# each run in LAST_RUN
+AODH_EXPIRER_RUN = '/usr/local/bin/aodh-expirer-run'
+AODH_EXPIRER_LAST_RUN = '/var/lib/aodh/expirer-last-run.json'
+AODH_EXPORTER = '/usr/local/bin/aodh-exporter'
+AODH_EXPORTER_SERVICE = '/etc/systemd/system/aodh-exporter.service'
+AODH_EXPORTER_PACKAGES = ['python3-psutil']
+NAGIOS_PLUGINS = '/usr/local/lib/nagios/plugins'
+AODH_LOG_DIR = '/var/log/aodh'
+APACHE_LOG_DIR = '/var/log/apache2'
+AODH_PY3_PACKAGE = '/usr/lib/python3/dist-packages/aodh'
+AODH_ALEMBIC_VERSIONS = os.path.join(AODH_PY3_PACKAGE,
+                                     'storage/sqlalchemy/alembic/versions')
+# aodh's transport_url, readable by nagios for the notifier queue check
+NAGIOS_TRANSPORT_URL = '/etc/nagios/aodh-transport-url'
+# Queues the aodh-notifier consumes alarm notifications from
+AODH_NOTIFIER_QUEUES = ['alarming.sample']
+
+# unitdata key holding the fingerprint of the last rendered configuration
+RENDER_FINGERPRINT_KEY = 'aodh.render.fingerprint'
+# unitdata key counting restarts skipped by section-aware restarts
+RESTARTS_AVOIDED_KEY = 'aodh.restarts.avoided'
+# unitdata key holding services waiting for the rolling restart lock
+PENDING_RESTARTS_KEY = 'aodh.restarts.pending'
+# unitdata key holding the resident memory, in MiB, of a process of each aodh
+# daemon that the API is sized against, and the key holding the largest seen
+# since the last render
+WORKER_RSS_KEY = 'aodh.worker.rss'
+WORKER_RSS_PEAK_KEY = 'aodh.worker.rss.peak'
+# Leader setting holding the cutoff of a purge-alarm-history run, and the
+# unitdata key holding its progress on the unit running it
+PURGE_CHECKPOINT_KEY = 'purge-alarm-history'
+PURGE_PROGRESS_KEY = 'aodh.purge.progress'
+# unitdata key holding the API sizing chosen at the last render
+API_SIZING_KEY = 'aodh.api.sizing'
+# Relative change in a daemon's measured memory needed to store a new sample,
+# so that the API is not re-sized on every small fluctuation
+WORKER_RSS_TOLERANCE = 0.1
+# Seconds after a render before a lower peak may shrink the stored sample.
+# Workers start small after a reload, so shrinking it any sooner would
+# resize the API back and forth.
+WORKER_RSS_SETTLE = 24 * 60 * 60
+
+# aodh.conf sections read by only some of the aodh daemons. A change to any
+# other section, e.g. [DEFAULT], [database] or [service_credentials], which
+# the API, evaluator, notifier and listener all use, affects every daemon.
+AODH_CONF_SECTION_DAEMONS = {
+    'api': ['api'],
+    'keystone_authtoken': ['api'],
+    'oslo_middleware': ['api'],
+    'oslo_policy': ['api'],
+    'coordination': ['evaluator'],
+    'evaluator': ['evaluator'],
+    'notifier': ['notifier'],
+    'listener': ['listener'],
+}
+
+# haproxy balance algorithms accepted for the aodh-api backend
+HAPROXY_BALANCE_ALGORITHMS = ('leastconn', 'roundrobin', 'static-rr',
+                              'first', 'source')
+
+# Daemons, besides the API, that accept a [<daemon>] workers option
+AODH_WORKER_DAEMONS = ('evaluator', 'notifier', 'listener')
+
+# systemd drop-in holding the resource controls of each of those daemons
+AODH_DAEMON_RESOURCES_CONF = (
+    '/etc/systemd/system/aodh-{0}.service.d/aodh-{0}-resources.conf')
+AODH_DAEMON_RESOURCES = {
+    AODH_DAEMON_RESOURCES_CONF.format(daemon): ['aodh-{}'.format(daemon)]
+    for daemon in AODH_WORKER_DAEMONS
+}
+
+# Options holding per-daemon systemd resource controls, and the [Service]
+# directive each one sets
+SYSTEMD_RESOURCE_OPTIONS = collections.OrderedDict([
+    ('daemon-cpu-affinity', 'CPUAffinity'),
+    ('daemon-cpu-quota', 'CPUQuota'),
+    ('daemon-memory-max', 'MemoryMax'),
+    ('daemon-nice', 'Nice'),
+    ('daemon-io-weight', 'IOWeight'),
+])
+SYSTEMD_DIR = '/etc/systemd/system/'
+
+# Prints the alembic revision of the aodh database, run with the system
+# python3 as SQLAlchemy and the database driver come with python3-aodh
+DB_REVISION_SCRIPT = """
+import configparser
+import sqlalchemy
+config = configparser.ConfigParser(interpolation=None)
+config.read('{}')
+engine = sqlalchemy.create_engine(config.get('database', 'connection'))
+with engine.connect() as connection:
+    print(connection.execute(sqlalchemy.text(
+        'SELECT version_num FROM alembic_version')).scalar() or '')
+""".format(AODH_CONF)
+
+# Prints the number of members of the tooz group the aodh evaluator workers
+# partition alarms through, run with the system python3 as tooz comes with
+# python3-aodh.  A group no evaluator has joined yet has no members.
+PARTITION_MEMBERS_SCRIPT = """
+import configparser
+import os
+import tooz.coordination
+config = configparser.ConfigParser(interpolation=None)
+config.read('{}')
+coordinator = tooz.coordination.get_coordinator(
+    config.get('coordination', 'backend_url'),
+    'charm-aodh-status-{{}}'.format(os.getpid()).encode('ascii'))
+coordinator.start()
+try:
+    print(len(coordinator.get_members('alarm_evaluator').get(timeout=10)))
+except tooz.coordination.GroupNotCreated:
+    print(0)
+finally:
+    coordinator.stop()
+""".format(AODH_CONF)
+
+# Optional relations which, once related, must complete before the unit is
+# ready
+OPTIONAL_RELATIONS = ('notification-amqp', 'shared-db-read-only')
+
+# charmhelpers probes run by assess_status(), memoized for a single pass
+STATUS_PROBES = ('service_running', 'port_has_listener')
+
+# Whether the status assessment has been deferred to the end of this hook
+_status_deferred = False
 
 
 charms_openstack.charm.use_defaults(
@@ -38,10 +194,395 @@ charms_openstack.charm.use_defaults(
 )
 
 
+def ini_sections(path):
+    """Parse an ini file into a dict of section name to option dict.
+
+    [DEFAULT] is kept as an ordinary section rather than being merged into
+    every other section.
+
+    :param path: path of the file to parse
+    :returns: dict, or None if the file is missing or cannot be parsed
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False,
+                                       default_section='charm-aodh-none')
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error):
+        return None
+    return {section: dict(parser.items(section))
+            for section in parser.sections()}
+
+
+def interface_relation_data(interfaces):
+    """Relation data held by the interfaces the configs are rendered from.
+
+    Only the relations of these interfaces are read, through the same cached
+    accessors the adapters use, rather than every relation of the unit.
+
+    :param interfaces: charms.reactive Endpoint or RelationBase instances
+    :returns: dict of relation id to dict of unit name to settings
+    """
+    data = {}
+    for interface in interfaces:
+        if interface is None:
+            continue
+        relations = getattr(interface, 'relations', None)
+        if relations is not None:
+            for relation in relations:
+                data[relation.relation_id] = {
+                    unit.unit_name: dict(unit.received_raw)
+                    for unit in relation.joined_units}
+            continue
+        for conversation in interface.conversations():
+            for rid in conversation.relation_ids:
+                data[rid] = {unit: hookenv.relation_get(rid=rid, unit=unit)
+                             for unit in hookenv.related_units(rid)}
+    return data
+
+
+def memcached_servers(memcache):
+    """List the 'host:port' addresses of the related memcached units.
+
+    :param memcache: the memcache interface
+    :returns: sorted list of strings
+    """
+    return ['{}:11211'.format(ch_ip.format_ipv6_addr(host) or host)
+            for host in sorted(memcache.memcache_hosts())]
+
+
+@charms_openstack.adapters.config_property
+def daemon_workers(cfg):
+    """Worker counts for the aodh evaluator, notifier and listener.
+
+    Each daemon uses its '<daemon>-workers' option when set, otherwise the
+    same CPU based count as the API workers.  Additional evaluator workers
+    only share the alarms out when a coordination backend is available, so
+    without one the evaluator defaults to a single worker.
+
+    :param cfg: the configuration adapter
+    :returns: dict of daemon name to worker count
+    """
+    workers = {}
+    for daemon in AODH_WORKER_DAEMONS:
+        workers[daemon] = (getattr(cfg, '{}_workers'.format(daemon)) or
+                           cfg.workers)
+    coordinated = (cfg.coordination_backend_url or
+                   reactive.is_flag_set('coordinator-memcached.available'))
+    if not cfg.evaluator_workers and not coordinated:
+        workers['evaluator'] = 1
+    return workers
+
+
+def per_daemon_values(value):
+    """Parse an option holding a value for some or all of the aodh daemons.
+
+    The option is a space separated list of entries.  A bare '<value>'
+    applies to every daemon in AODH_WORKER_DAEMONS, a '<daemon>:<value>'
+    entry to that daemon only, taking precedence over a bare value.
+
+    :param value: the option value, possibly None
+    :returns: dict of daemon name to value
+    :raises: ValueError for an entry naming an unknown daemon
+    """
+    values = {}
+    overrides = {}
+    for entry in (value or '').split():
+        daemon, sep, setting = entry.partition(':')
+        if not sep:
+            values.update((d, entry) for d in AODH_WORKER_DAEMONS)
+        elif daemon in AODH_WORKER_DAEMONS:
+            overrides[daemon] = setting
+        else:
+            raise ValueError("unknown daemon '{}'".format(daemon))
+    values.update(overrides)
+    return values
+
+
+@charms_openstack.adapters.config_property
+def systemd_resources(cfg):
+    """systemd resource controls for the aodh evaluator, notifier and
+    listener drop-ins.
+
+    An option naming an unknown daemon is ignored here and reported by
+    custom_assess_status_check() instead.
+
+    :param cfg: the configuration adapter
+    :returns: dict of daemon name to an ordered dict of directive to value
+    """
+    resources = {daemon: collections.OrderedDict()
+                 for daemon in AODH_WORKER_DAEMONS}
+    for option, directive in SYSTEMD_RESOURCE_OPTIONS.items():
+        try:
+            values = per_daemon_values(
+                getattr(cfg, option.replace('-', '_')))
+        except ValueError:
+            continue
+        for daemon, value in values.items():
+            resources[daemon][directive] = value
+    return resources
+
+
+@charms_openstack.adapters.config_property
+def api_memory_sizing(cfg):
+    """Number of aodh-api WSGI processes that fit the memory budget.
+
+    Without memory-budget, or before the resident memory of the API has been
+    measured, the CPU based count is used unchanged.  Otherwise the
+    evaluator, notifier and listener, each a parent process plus its
+    workers, are reserved first at their measured size, or at the API's
+    while not yet measured, and the API gets as many processes of the rest
+    as fit, at least one and at most the CPU based count.
+
+    :param cfg: the configuration adapter
+    :returns: dict with the chosen processes, the CPU based processes and the
+              headroom in MiB, None without a budget
+    """
+    processes = cfg.wsgi_worker_context['processes']
+    sizing = {'processes': processes,
+              'cpu_processes': processes,
+              'headroom': None}
+    rss = unitdata.kv().get(WORKER_RSS_KEY) or {}
+    if not cfg.memory_budget or not rss.get('api'):
+        return sizing
+    reserved = sum((workers + 1) * rss.get(daemon, rss['api'])
+                   for daemon, workers in daemon_workers(cfg).items())
+    fits = (cfg.memory_budget - reserved) // rss['api']
+    sizing['processes'] = max(1, min(processes, fits))
+    sizing['headroom'] = (cfg.memory_budget - reserved -
+                          sizing['processes'] * rss['api'])
+    return sizing
+
+
+@charms_openstack.adapters.config_property
+def wsgi_tuning(cfg):
+    """mod_wsgi daemon process tuning for the aodh-api vhost.
+
+    Explicitly configured values win; otherwise the listen backlog is sized
+    to hold a few requests per thread across all of the WSGI processes so
+    that bursts queue in mod_wsgi, where queue-timeout can shed them, rather
+    than in the kernel.
+
+    :param cfg: the configuration adapter
+    :returns: dict of WSGIDaemonProcess settings
+    """
+    threads = cfg.wsgi_threads or 10
+    processes = cfg.wsgi_worker_context['processes']
+    return {
+        'threads': threads,
+        'listen_backlog': (cfg.wsgi_listen_backlog or
+                           max(100, processes * threads * 4)),
+        'queue_timeout': cfg.wsgi_queue_timeout,
+        'request_timeout': cfg.wsgi_request_timeout,
+        'inactivity_timeout': cfg.wsgi_inactivity_timeout,
+    }
+
+
+@charms_openstack.adapters.config_property
+def database_pool(cfg):
+    """oslo.db connection pool settings for the [database] section.
+
+    All aodh processes on the unit read the same aodh.conf, so each one gets
+    an identical pool.  With database-connections-per-unit set, the budget is
+    divided evenly between the API and daemon worker processes; otherwise
+    each process may hold one connection per API thread, with no overflow,
+    so the total per unit is still processes * max_pool_size.
+
+    :param cfg: the configuration adapter
+    :returns: dict of oslo.db pool settings, None meaning the library default
+    """
+    processes = cfg.workers + sum(daemon_workers(cfg).values())
+    if cfg.database_connections_per_unit:
+        per_process = max(2, cfg.database_connections_per_unit // processes)
+        pool_size = (per_process + 1) // 2
+        overflow = per_process - pool_size
+    else:
+        pool_size = wsgi_tuning(cfg)['threads']
+        overflow = 0
+    if cfg.database_max_pool_size is not None:
+        pool_size = cfg.database_max_pool_size
+    if cfg.database_max_overflow is not None:
+        overflow = cfg.database_max_overflow
+    return {
+        'max_pool_size': pool_size,
+        'max_overflow': overflow,
+        'pool_timeout': cfg.database_pool_timeout,
+        'connection_recycle_time': cfg.database_connection_recycle_time,
+    }
+
+
+@charms_openstack.adapters.config_property
+def messaging_tuning(cfg):
+    """oslo.messaging consumer settings for the notifier and listener.
+
+    Both daemons consume in batches, so by default each process may hold
+    two batches of unacknowledged messages: one being processed and one
+    being filled.  The prefetch limit stops a single process hoarding the
+    queue while its siblings idle, so throughput scales with the notifier
+    and listener worker counts, and the executor pool gets one thread per
+    prefetched message so none waits for a thread once delivered.
+
+    :param cfg: the configuration adapter
+    :returns: dict of oslo.messaging settings, None meaning the default
+    """
+    batch_size = max(cfg.notifier_batch_size or 1,
+                     cfg.listener_batch_size or 1)
+    prefetch = cfg.rabbit_qos_prefetch_count
+    if prefetch is None:
+        prefetch = 2 * batch_size
+    return {
+        'rabbit_qos_prefetch_count': prefetch,
+        'executor_thread_pool_size': (cfg.executor_thread_pool_size or
+                                      prefetch or None),
+        'heartbeat_timeout_threshold': cfg.rabbit_heartbeat_timeout_threshold,
+        'heartbeat_rate': cfg.rabbit_heartbeat_rate,
+    }
+
+
+@charms_openstack.adapters.config_property
+def haproxy_api(cfg):
+    """haproxy settings for the aodh-api frontend and backends.
+
+    Timeouts are in milliseconds.  A keep-alive timeout switches the aodh-api
+    proxy from TCP to HTTP mode, so that haproxy can hold client connections
+    open between requests.
+
+    :param cfg: the configuration adapter
+    :returns: dict of haproxy settings, None keeping the layer's setting
+    """
+    return {
+        'balance': cfg.haproxy_balance or None,
+        'server_maxconn': cfg.haproxy_server_maxconn,
+        'queue_timeout': cfg.haproxy_api_queue_timeout,
+        'client_timeout': cfg.haproxy_api_client_timeout,
+        'server_timeout': cfg.haproxy_api_server_timeout,
+        'keep_alive_timeout': cfg.haproxy_http_keep_alive_timeout,
+    }
+
+
+def tune_haproxy_cfg(content, settings):
+    """Apply the aodh-api settings to the layer's rendered haproxy.cfg.
+
+    The layer template has no hook for its frontend and backend stanzas, so
+    the settings are appended to each of them, where they override the
+    backend's balance and the timeouts of the defaults section.  maxconn is
+    added to every backend server.
+
+    :param content: haproxy.cfg as rendered from the layer template
+    :param settings: the haproxy_api config property
+    :returns: string
+    """
+    frontend = []
+    backend = []
+    if settings['keep_alive_timeout']:
+        frontend += ['mode http', 'option httplog', 'option http-keep-alive',
+                     'timeout http-keep-alive {}'.format(
+                         settings['keep_alive_timeout'])]
+        backend += ['mode http', 'option http-keep-alive']
+    if settings['client_timeout']:
+        frontend.append('timeout client {}'.format(
+            settings['client_timeout']))
+    if settings['balance']:
+        backend.append('balance {}'.format(settings['balance']))
+    for name in ('queue', 'server'):
+        timeout = settings['{}_timeout'.format(name)]
+        if timeout:
+            backend.append('timeout {} {}'.format(name, timeout))
+    maxconn = settings['server_maxconn']
+    if not (frontend or backend or maxconn):
+        return content
+    appended = {'frontend': frontend, 'backend': backend}
+    lines = []
+
+    def close(section):
+        end = len(lines)
+        while end and not lines[end - 1].strip():
+            end -= 1
+        lines[end:end] = ['    ' + line for line in appended.get(section, [])]
+
+    section = None
+    for line in content.splitlines():
+        if line and not line[0].isspace():
+            close(section)
+            section = line.split()[0]
+        elif (section == 'backend' and maxconn and
+              line.split()[:1] == ['server']):
+            line = '{} maxconn {}'.format(line.rstrip(), maxconn)
+        lines.append(line)
+    close(section)
+    return '\n'.join(lines) + '\n'
+
+
+def replace_port(uri, port):
+    """Return uri with the port of its host replaced.
+
+    :param uri: URI with a host, e.g. an SQLAlchemy database URL
+    :param port: the new port
+    :returns: string
+    """
+    parts = urllib.parse.urlsplit(uri)
+    userinfo = parts.netloc.rpartition('@')[0]
+    host = parts.hostname
+    if ':' in host:
+        host = '[{}]'.format(host)
+    netloc = '{}:{}'.format(host, port)
+    if userinfo:
+        netloc = '{}@{}'.format(userinfo, netloc)
+    return urllib.parse.urlunsplit(parts._replace(netloc=netloc))
+
+
+class SharedDBRelationAdapter(
+        charms_openstack.adapters.DatabaseRelationAdapter):
+    """
+    Adapter for the shared-db relation, adding the read-only URI used for
+    oslo.db's slave_connection when a mysql-router read-only port is set.
+    """
+
+    @property
+    def read_only_uri(self):
+        port = hookenv.config('database-read-only-port')
+        uri = self.uri
+        if port and uri:
+            return replace_port(uri, port)
+        return None
+
+
+class MemcacheRelationAdapter(
+        charms_openstack.adapters.OpenStackRelationAdapter):
+    """
+    Adapter for the memcache interface, used as the tooz coordination
+    backend for partitioning alarm evaluation across units and as the
+    keystonemiddleware token cache.
+    """
+
+    interface_type = 'memcache'
+
+    @property
+    def url(self):
+        hosts = sorted(self.relation.memcache_hosts())
+        if hosts:
+            return 'memcached://{}:11211?timeout=5'.format(hosts[0])
+        return None
+
+    @property
+    def servers(self):
+        return ','.join(memcached_servers(self.relation))
+
+
 class AodhAdapters(charms_openstack.adapters.OpenStackAPIRelationAdapters):
     """
     Adapters class for the Aodh charm.
     """
+
+    relation_adapters = {
+        'coordinator_memcached': MemcacheRelationAdapter,
+        'shared_db': SharedDBRelationAdapter,
+        'shared_db_read_only':
+            charms_openstack.adapters.DatabaseRelationAdapter,
+        'notification_amqp':
+            charms_openstack.adapters.RabbitMQRelationAdapter,
+    }
+
     def __init__(self, relations, charm_instance=None):
         super(AodhAdapters, self).__init__(
             relations,
@@ -71,6 +612,18 @@ class AodhCharm(charms_openstack.plugins.PolicydOverridePlugin,
     services = ['aodh-api', 'aodh-evaluator',
                 'aodh-notifier', 'aodh-listener']
 
+    # Service providing each aodh daemon, used to decide which services an
+    # aodh.conf change needs to restart
+    daemon_services = {
+        'api': 'aodh-api',
+        'evaluator': 'aodh-evaluator',
+        'notifier': 'aodh-notifier',
+        'listener': 'aodh-listener',
+    }
+
+    # Services that pick up configuration changes on a graceful reload
+    reload_services = ['haproxy']
+
     # Ports that need exposing.
     default_service = 'aodh-api'
     api_ports = {
@@ -89,6 +642,7 @@ class AodhCharm(charms_openstack.plugins.PolicydOverridePlugin,
     restart_map = {
         AODH_CONF: services,
         AODH_API_SYSTEMD_CONF: ['aodh-api'],
+        **AODH_DAEMON_RESOURCES
     }
 
     # Resource when in HA mode
@@ -127,10 +681,739 @@ class AodhCharm(charms_openstack.plugins.PolicydOverridePlugin,
     # policyd override constants
     policyd_service_name = 'aodh'
 
+    def render_fingerprint(self, interfaces):
+        """Digest of the inputs that the rendered configuration depends on.
+
+        This covers the charm config, the relation data of the interfaces
+        rendered from and the current content of every rendered file, so
+        that manual edits of a target are still put right on the next hook.
+
+        :param interfaces: the interfaces passed to render_with_interfaces
+        :returns: hex digest string
+        """
+        inputs = {
+            'release': self.release,
+            'config': dict(self.config),
+            'relations': interface_relation_data(interfaces),
+            'targets': {path: ch_host.path_hash(path)
+                        for path in self.full_restart_map.keys()},
+            'worker_rss': unitdata.kv().get(WORKER_RSS_KEY),
+        }
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+    def render_with_interfaces(self, interfaces, configs=None):
+        """Render the configs unless nothing they depend on has changed.
+
+        Templates may change with the charm itself, so upgrade-charm always
+        renders.
+        """
+        kv = unitdata.kv()
+        if (hookenv.hook_name() != 'upgrade-charm' and
+                kv.get(RENDER_FINGERPRINT_KEY) ==
+                self.render_fingerprint(interfaces)):
+            hookenv.log('Configuration inputs unchanged, skipping render',
+                        level=hookenv.DEBUG)
+            return
+        super(AodhCharm, self).render_with_interfaces(interfaces, configs)
+        kv.set(RENDER_FINGERPRINT_KEY, self.render_fingerprint(interfaces))
+        kv.unset(WORKER_RSS_PEAK_KEY)
+        if self.config.get('memory-budget'):
+            adapters = self.adapters_class(interfaces, charm_instance=self)
+            kv.set(API_SIZING_KEY, adapters.options.api_memory_sizing)
+        else:
+            kv.unset(API_SIZING_KEY)
+
+    def render_configs(self, configs, adapters_instance=None):
+        """Render the configs, with the aodh-api settings applied to the
+        layer's haproxy.cfg.
+
+        haproxy.cfg is rendered and written on its own, so that haproxy is
+        only reloaded once, with its final content.
+
+        :param configs: list of target paths
+        :param adapters_instance: the adapters to render with
+        """
+        configs = list(configs)
+        if self.HAPROXY_CONF in configs:
+            configs.remove(self.HAPROXY_CONF)
+            adapters = adapters_instance or self.adapters_instance
+            with self.restart_on_change():
+                content = ch_templating.render(
+                    source=os.path.basename(self.HAPROXY_CONF),
+                    target=None,
+                    context=adapters,
+                    template_loader=ch_os_templating.get_loader(
+                        'templates/', self.release))
+                ch_host.write_file(
+                    self.HAPROXY_CONF,
+                    tune_haproxy_cfg(
+                        content, adapters.options.haproxy_api).encode('utf-8'),
+                    group=self.group, perms=0o440)
+        super(AodhCharm, self).render_configs(configs, adapters_instance)
+
+    def conf_change_services(self, old_sections, new_sections, services):
+        """Filter services down to those reading the changed sections.
+
+        :param old_sections: ini_sections() of aodh.conf before rendering
+        :param new_sections: ini_sections() of aodh.conf after rendering
+        :param services: services restart_map lists for aodh.conf
+        :returns: list of services
+        """
+        if old_sections is None or new_sections is None:
+            return services
+        daemons = set()
+        for section in set(old_sections) | set(new_sections):
+            if old_sections.get(section) != new_sections.get(section):
+                daemons.update(AODH_CONF_SECTION_DAEMONS.get(
+                    section, self.daemon_services.keys()))
+        wanted = [self.daemon_services[daemon] for daemon in daemons]
+        return [service for service in services if service in wanted]
+
+    @contextlib.contextmanager
+    def restart_on_change(self):
+        """Restart only the services affected by the wrapped changes.
+
+        aodh.conf is compared section by section, so that for example an
+        [api] change does not restart the evaluator, notifier and listener.
+        Services in reload_services are reloaded instead of restarted.  The
+        number of restarts saved is kept in unitdata.  A changed systemd
+        unit or drop-in is loaded with a daemon-reload before any restart.
+        """
+        restart_map = self.full_restart_map
+        checksums = {path: ch_host.path_hash(path) for path in restart_map}
+        old_sections = ini_sections(AODH_CONF)
+        yield
+        naive = []
+        restarts = []
+        changed = []
+        for path, services in restart_map.items():
+            if ch_host.path_hash(path) == checksums[path]:
+                continue
+            changed.append(path)
+            naive.extend(services)
+            if path == AODH_CONF:
+                services = self.conf_change_services(
+                    old_sections, ini_sections(AODH_CONF), services)
+            restarts.extend(services)
+        if any(path.startswith(SYSTEMD_DIR) for path in changed):
+            self.daemon_reload()
+        if not naive or ch_os_utils.is_unit_paused_set():
+            return
+        naive = list(collections.OrderedDict.fromkeys(naive))
+        restarts = list(collections.OrderedDict.fromkeys(restarts))
+        self.restart_services(restarts)
+        avoided = len(naive) - len(
+            [s for s in restarts if s not in self.reload_services])
+        if avoided:
+            kv = unitdata.kv()
+            kv.set(RESTARTS_AVOIDED_KEY,
+                   kv.get(RESTARTS_AVOIDED_KEY, 0) + avoided)
+            hookenv.log('Avoided {} service restart(s), restarted: {}'
+                        .format(avoided, ', '.join(restarts) or 'none'),
+                        level=hookenv.DEBUG)
+
+    def restart_all(self):
+        """Restart all services, one unit at a time when clustered."""
+        self.restart_services(self.full_service_list)
+
+    def restart_services(self, services):
+        """Restart or reload services, rolling across the cluster.
+
+        A unit with peers queues the services and sets the
+        'aodh.restart.pending' flag; the handlers then take the cluster-wide
+        'restart' lock before run_pending_restarts() is called, so the API
+        tier behind haproxy never goes away all at once.
+
+        :param services: list of services
+        """
+        if not services:
+            return
+        if self.cluster_size() > 1:
+            kv = unitdata.kv()
+            pending = kv.get(PENDING_RESTARTS_KEY, []) + list(services)
+            kv.set(PENDING_RESTARTS_KEY,
+                   list(collections.OrderedDict.fromkeys(pending)))
+            reactive.set_flag('aodh.restart.pending')
+        else:
+            self.perform_restarts(services)
+
+    def run_pending_restarts(self):
+        """Perform the restarts queued by restart_services()."""
+        kv = unitdata.kv()
+        services = kv.get(PENDING_RESTARTS_KEY, [])
+        if not ch_os_utils.is_unit_paused_set():
+            self.perform_restarts(services)
+        kv.unset(PENDING_RESTARTS_KEY)
+
+    def perform_restarts(self, services):
+        """Restart, or reload, services and wait for the API to be healthy.
+
+        :param services: list of services
+        """
+        for service in services:
+            if service in self.reload_services:
+                ch_host.service_reload(service)
+            else:
+                ch_host.service_restart(service)
+        if self.daemon_services['api'] in services:
+            self.wait_for_api()
+
+    def local_api_url(self):
+        """URL of the aodh-api version document served by this unit.
+
+        :returns: string
+        """
+        return 'http://127.0.0.1:{}/'.format(ch_cluster.determine_api_port(
+            self.api_port('aodh-api'), singlenode_mode=True))
+
+    def wait_for_api(self):
+        """Wait for the local aodh-api to answer HTTP requests.
+
+        Any response below 500 counts as healthy, as the version document at
+        '/' does not need authentication.
+
+        :returns: True if healthy before rolling-restart-api-timeout expired
+        """
+        timeout = self.config.get('rolling-restart-api-timeout') or 0
+        url = self.local_api_url()
+        deadline = time.time() + timeout
+        while True:
+            try:
+                urllib_request.urlopen(url, timeout=5)
+                return True
+            except urllib_request.HTTPError as e:
+                if e.code < 500:
+                    return True
+            except OSError:
+                pass
+            if time.time() >= deadline:
+                hookenv.log('aodh-api not healthy {}s after restart'
+                            .format(timeout), level=hookenv.WARNING)
+                return False
+            time.sleep(2)
+
+    @staticmethod
+    def package_db_revision():
+        """Alembic head revision of the installed aodh package.
+
+        The head is the one revision no other migration script names as
+        its down_revision.
+
+        :returns: string, or None if it cannot be determined
+        """
+        revisions = set()
+        parents = set()
+        try:
+            names = os.listdir(AODH_ALEMBIC_VERSIONS)
+        except OSError:
+            return None
+        for name in names:
+            if not name.endswith('.py'):
+                continue
+            with open(os.path.join(AODH_ALEMBIC_VERSIONS, name)) as f:
+                for line in f:
+                    match = re.match(r'(down_)?revision\s*=(.*)', line)
+                    if not match:
+                        continue
+                    found = re.findall(r'[\'"](\w+)[\'"]', match.group(2))
+                    if match.group(1):
+                        parents.update(found)
+                    else:
+                        revisions.update(found)
+        heads = revisions - parents
+        if len(heads) != 1:
+            return None
+        return heads.pop()
+
+    @staticmethod
+    def database_revision():
+        """Alembic revision the aodh database is at.
+
+        :returns: string, or None if it cannot be read
+        """
+        try:
+            return subprocess.check_output(
+                ['python3', '-c', DB_REVISION_SCRIPT],
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True).strip() or None
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def db_sync_done(self):
+        """Whether the leader has migrated the database to the schema head
+        of the installed package.
+
+        :returns: boolean
+        """
+        head = self.package_db_revision()
+        if head is None:
+            return bool(hookenv.leader_get('db-sync-done'))
+        return hookenv.leader_get('db-sync-revision') == head
+
+    def db_sync(self):
+        """Migrate the database, on the leader only, when it is behind.
+
+        The migration is skipped when the database is already at the
+        package's alembic head, e.g. after a leader change.  Completion is
+        recorded in leader settings, from which followers learn it.
+
+        :returns: True if aodh-dbsync ran
+        """
+        if self.db_sync_done():
+            return False
+        if not hookenv.is_leader():
+            hookenv.log('Deferring aodh-dbsync to the leader',
+                        level=hookenv.DEBUG)
+            return False
+        head = self.package_db_revision()
+        migrated = head is None or self.database_revision() != head
+        if migrated:
+            subprocess.check_call(self.sync_cmd)
+        hookenv.leader_set({'db-sync-done': True, 'db-sync-revision': head})
+        return migrated
+
+    def coordination_enabled(self):
+        """Whether alarm evaluation is partitioned via a tooz backend.
+
+        :returns: boolean
+        """
+        return bool(self.config.get('coordination-backend-url') or
+                    reactive.is_flag_set('coordinator-memcached.available'))
+
+    def cluster_size(self):
+        """Number of aodh units, i.e. the local unit plus its peers.
+
+        :returns: int
+        """
+        members = 1
+        for rid in hookenv.relation_ids('cluster'):
+            members += len(hookenv.related_units(rid))
+        return members
+
+    @staticmethod
+    def partition_members():
+        """Number of evaluator workers in the tooz partitioning group.
+
+        These are read from the coordination backend aodh.conf points the
+        evaluators at, so only workers that actually joined are counted.
+
+        :returns: int, or None if the backend cannot be queried
+        """
+        if not os.path.isdir(AODH_PY3_PACKAGE):
+            return None
+        try:
+            return int(subprocess.check_output(
+                ['python3', '-c', PARTITION_MEMBERS_SCRIPT],
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True, timeout=30))
+        except (OSError, ValueError, subprocess.SubprocessError):
+            return None
+
+    def status_notes(self):
+        """Informational notes appended to the 'Unit is ready' message.
+
+        :returns: list of strings
+        """
+        notes = []
+        if self.coordination_enabled():
+            members = self.partition_members()
+            if members is not None:
+                notes.append('partition members: {}'.format(members))
+        if self.expirer_enabled():
+            last_run = self.expirer_last_run()
+            if last_run:
+                seconds, rows, status = last_run
+                notes.append('last expiry: {}s, {} rows{}'.format(
+                    seconds, rows,
+                    '' if status == 'ok' else ' ({})'.format(status)))
+        sizing = unitdata.kv().get(API_SIZING_KEY)
+        if sizing and sizing['headroom'] is not None:
+            notes.append('api processes: {}/{}, headroom: {}MiB'.format(
+                sizing['processes'], sizing['cpu_processes'],
+                sizing['headroom']))
+        return notes
+
     @staticmethod
-    def reload_and_restart():
-        if ch_host.init_is_systemd():
+    def measure_worker_rss():
+        """Resident memory of the largest running aodh process, by daemon.
+
+        :returns: dict of daemon name to MiB, for the daemons found running
+        """
+        samples = collections.defaultdict(list)
+        daemons = ('api',) + AODH_WORKER_DAEMONS
+        for process in psutil.process_iter(['cmdline', 'memory_info']):
+            # Only the program is matched as arguments may name other
+            # daemons' logs.  mod_wsgi processes show as '(wsgi:aodh-api)'.
+            program = ' '.join((process.info['cmdline'] or [])[:2])
+            memory = process.info['memory_info']
+            for daemon in daemons:
+                if memory and 'aodh-{}'.format(daemon) in program:
+                    samples[daemon].append(memory.rss)
+                    break
+        return {daemon: max(rss) // 2 ** 20
+                for daemon, rss in samples.items()}
+
+    def update_worker_rss(self):
+        """Store the measured memory of the aodh daemons for API sizing.
+
+        The API is sized against the high-water mark of each daemon since
+        the last render, not its current size, as workers start small after
+        every reload.  A peak above the stored sample replaces it straight
+        away, a lower one only WORKER_RSS_SETTLE after the render.  Either
+        way it must differ by more than WORKER_RSS_TOLERANCE, as the stored
+        sample feeds the render fingerprint.
+
+        :returns: whether a new sample was stored
+        """
+        kv = unitdata.kv()
+        if not self.config.get('memory-budget'):
+            kv.unset(WORKER_RSS_KEY)
+            kv.unset(WORKER_RSS_PEAK_KEY)
+            return False
+        now = time.time()
+        peak = kv.get(WORKER_RSS_PEAK_KEY) or {'since': now, 'rss': {}}
+        for daemon, rss in self.measure_worker_rss().items():
+            peak['rss'][daemon] = max(rss, peak['rss'].get(daemon, 0))
+        kv.set(WORKER_RSS_PEAK_KEY, peak)
+        stored = kv.get(WORKER_RSS_KEY) or {}
+        settled = now - peak['since'] >= WORKER_RSS_SETTLE
+        changed = False
+        for daemon, rss in peak['rss'].items():
+            old = stored.get(daemon, 0)
+            if (rss > old * (1 + WORKER_RSS_TOLERANCE) or
+                    settled and rss < old * (1 - WORKER_RSS_TOLERANCE)):
+                changed = True
+        if not changed:
+            return False
+        kv.set(WORKER_RSS_KEY, dict(stored, **peak['rss']))
+        return True
+
+    @contextlib.contextmanager
+    def memoized_status_probes(self):
+        """Memoize the service and port probes made while assessing status.
+
+        The paused, services and ports checks each probe the same services
+        and ports; within one pass the answers cannot usefully change.
+        """
+        originals = {name: getattr(ch_os_utils, name)
+                     for name in STATUS_PROBES}
+        try:
+            for name, probe in originals.items():
+                setattr(ch_os_utils, name,
+                        functools.lru_cache(maxsize=None)(probe))
+            yield
+        finally:
+            for name, probe in originals.items():
+                setattr(ch_os_utils, name, probe)
+
+    def assess_status(self):
+        """Assess the unit status with memoized service and port probes."""
+        with self.memoized_status_probes():
+            super().assess_status()
+
+    def custom_assess_status_check(self):
+        """Check the daemon resource controls and the haproxy balance
+        algorithm, and wait for optional relations once they have been
+        related.
+
+        :returns: (status, message) or (None, None)
+        """
+        for option in SYSTEMD_RESOURCE_OPTIONS:
+            try:
+                per_daemon_values(self.config.get(option))
+            except ValueError as e:
+                return 'blocked', 'invalid {}: {}'.format(option, e)
+        balance = self.config.get('haproxy-balance')
+        if balance and balance not in HAPROXY_BALANCE_ALGORITHMS:
+            return 'blocked', "invalid haproxy-balance '{}'".format(balance)
+        incomplete = [
+            relation for relation in OPTIONAL_RELATIONS
+            if (hookenv.relation_ids(relation) and
+                not reactive.is_flag_set('{}.available'.format(relation)))]
+        if incomplete:
+            return 'waiting', '{} incomplete'.format(
+                ', '.join("'{}'".format(r) for r in incomplete))
+        return super().custom_assess_status_check()
+
+    def custom_assess_status_last_check(self):
+        """Report informational notes once the unit is otherwise ready.
+
+        :returns: (status, message) or (None, None)
+        """
+        notes = self.status_notes()
+        if notes:
+            return 'active', 'Unit is ready ({})'.format(', '.join(notes))
+        return None, None
+
+    def expirer_enabled(self):
+        """Whether this unit should schedule aodh-expirer.
+
+        Expiry runs against the shared database, so only the leader runs it
+        and only when a positive alarm history TTL is configured.
+
+        :returns: boolean
+        """
+        return bool(hookenv.is_leader() and
+                    (self.config.get('alarm-history-time-to-live') or 0) > 0)
+
+    def configure_expirer(self):
+        """Install, update or remove the aodh-expirer systemd timer."""
+        if self.expirer_enabled():
+            context = {
+                'expirer': AODH_EXPIRER_RUN,
+                'schedule': self.config.get('alarm-history-expiry-schedule'),
+                'batch_size': self.config.get(
+                    'alarm-history-delete-batch-size') or 0,
+                'window': self.config.get('alarm-history-expiry-window') or 0,
+            }
+            with open(os.path.join(hookenv.charm_dir(), 'files',
+                                   'aodh-expirer-run')) as f:
+                ch_host.write_file(AODH_EXPIRER_RUN, f.read(), perms=0o755)
+            changed = False
+            for target in (AODH_EXPIRER_SERVICE, AODH_EXPIRER_TIMER):
+                old_hash = ch_host.path_hash(target)
+                ch_templating.render(
+                    os.path.basename(target), target, context,
+                    templates_dir=os.path.join(hookenv.charm_dir(),
+                                               'templates'),
+                    perms=0o644)
+                changed = changed or old_hash != ch_host.path_hash(target)
+            if changed:
+                subprocess.check_call(['systemctl', 'daemon-reload'])
+                ch_host.service('enable', 'aodh-expirer.timer')
+                ch_host.service_restart('aodh-expirer.timer')
+        elif os.path.exists(AODH_EXPIRER_TIMER):
+            ch_host.service('disable', 'aodh-expirer.timer')
+            ch_host.service_stop('aodh-expirer.timer')
+            for target in (AODH_EXPIRER_SERVICE, AODH_EXPIRER_TIMER,
+                           AODH_EXPIRER_RUN, AODH_EXPIRER_LAST_RUN):
+                if os.path.exists(target):
+                    os.remove(target)
             subprocess.check_call(['systemctl', 'daemon-reload'])
+
+    def exporter_enabled(self):
+        """Whether the Prometheus exporter should run on this unit.
+
+        :returns: boolean
+        """
+        return bool(hookenv.relation_ids('metrics-endpoint'))
+
+    def configure_exporter(self):
+        """Install, update or remove the aodh Prometheus exporter.
+
+        Only the leader exports the database derived metrics, as every unit
+        would report the same alarm and alarm_history counts.  The exporter
+        listens on the address of the metrics-endpoint binding only, and runs
+        as the aodh user with read access to just the aodh and apache2 logs.
+        """
+        if self.exporter_enabled():
+            ch_fetch.apt_install(
+                ch_fetch.filter_installed_packages(AODH_EXPORTER_PACKAGES),
+                fatal=True)
+            for directory in (AODH_LOG_DIR, APACHE_LOG_DIR):
+                self.grant_log_access('aodh', directory)
+            old_hashes = [ch_host.path_hash(target)
+                          for target in (AODH_EXPORTER, AODH_EXPORTER_SERVICE)]
+            with open(os.path.join(hookenv.charm_dir(), 'files',
+                                   'aodh-exporter')) as f:
+                ch_host.write_file(AODH_EXPORTER, f.read(), perms=0o755)
+            ch_templating.render(
+                os.path.basename(AODH_EXPORTER_SERVICE),
+                AODH_EXPORTER_SERVICE,
+                {
+                    'exporter': AODH_EXPORTER,
+                    'address': hookenv.network_get_primary_address(
+                        'metrics-endpoint'),
+                    'port': self.config.get('metrics-port'),
+                    'database': hookenv.is_leader(),
+                },
+                templates_dir=os.path.join(hookenv.charm_dir(), 'templates'),
+                perms=0o644)
+            if old_hashes != [ch_host.path_hash(target) for target in
+                              (AODH_EXPORTER, AODH_EXPORTER_SERVICE)]:
+                subprocess.check_call(['systemctl', 'daemon-reload'])
+                ch_host.service('enable', 'aodh-exporter')
+                ch_host.service_restart('aodh-exporter')
+            hookenv.open_port(self.config.get('metrics-port'))
+            self.publish_scrape_jobs()
+        elif os.path.exists(AODH_EXPORTER_SERVICE):
+            ch_host.service('disable', 'aodh-exporter')
+            ch_host.service_stop('aodh-exporter')
+            hookenv.close_port(self.config.get('metrics-port'))
+            for target in (AODH_EXPORTER, AODH_EXPORTER_SERVICE):
+                if os.path.exists(target):
+                    os.remove(target)
+            subprocess.check_call(['systemctl', 'daemon-reload'])
+
+    def publish_scrape_jobs(self):
+        """Describe the exporter on the metrics-endpoint relations.
+
+        This follows the prometheus_scrape interface: each unit publishes
+        its address, and the leader publishes a job whose '*' target is
+        expanded by Prometheus to every unit address.
+        """
+        port = self.config.get('metrics-port')
+        for rid in hookenv.relation_ids('metrics-endpoint'):
+            hookenv.relation_set(rid, relation_settings={
+                'prometheus_scrape_unit_address': hookenv.ingress_address(
+                    rid=rid, unit=hookenv.local_unit()),
+                'prometheus_scrape_unit_name': hookenv.local_unit(),
+            })
+            if hookenv.is_leader():
+                hookenv.relation_set(rid, app=True, relation_settings={
+                    'scrape_jobs': json.dumps([{
+                        'metrics_path': '/metrics',
+                        'static_configs': [
+                            {'targets': ['*:{}'.format(port)]}],
+                    }]),
+                    'scrape_metadata': json.dumps({
+                        'model': hookenv.model_name(),
+                        'model_uuid': hookenv.model_uuid(),
+                        'application': hookenv.application_name(),
+                        'unit': hookenv.local_unit(),
+                        'charm_name': hookenv.charm_name(),
+                    }),
+                })
+
+    @staticmethod
+    def benchmark_evaluator(alarms, cycles):
+        """Time alarm evaluation and notifier dispatch on this unit.
+
+        The aodh-benchmark-evaluator script runs with the system python3, as
+        it drives aodh's own evaluator and notifier, against synthetic alarms
+        that it deletes again.
+
+        :param alarms: number of synthetic alarms
+        :param cycles: number of evaluation cycles
+        :returns: dict of throughput and latency results
+        :raises: RuntimeError without python3-aodh, i.e. before Rocky
+        """
+        if not os.path.isdir(AODH_PY3_PACKAGE):
+            raise RuntimeError('benchmark-evaluator needs python3-aodh, '
+                               'available from Rocky')
+        output = subprocess.check_output(
+            ['python3',
+             os.path.join(hookenv.charm_dir(), 'files',
+                          'aodh-benchmark-evaluator'),
+             '--config-file', AODH_CONF,
+             '--alarms', str(alarms),
+             '--cycles', str(cycles)],
+            universal_newlines=True)
+        return json.loads(output)
+
+    def purge_alarm_history(self, older_than=None, batch_size=None,
+                            interval=1.0):
+        """Delete old alarm history in batches, reporting progress.
+
+        Only the leader purges, so that no two units ever do at once.  The
+        cutoff is recorded in leader settings when the purge starts, and the
+        running total is checkpointed in unitdata after every batch, so that
+        followers do not see a leader-settings-changed hook per batch.  Run
+        without older_than, an interrupted purge is resumed, also by a new
+        leader.  Should leadership move during the purge, it stops after the
+        current batch.
+
+        :param older_than: delete records older than this many days, or None
+                           to resume the interrupted purge
+        :param batch_size: records per batch, alarm-history-delete-batch-size
+                           by default
+        :param interval: seconds to sleep between batches
+        :returns: dict with the 'before' cutoff and the 'deleted' total
+        :raises: RuntimeError when the purge cannot run or is interrupted
+        """
+        if not hookenv.is_leader():
+            raise RuntimeError('purge-alarm-history must run on the leader')
+        if not os.path.isdir(AODH_PY3_PACKAGE):
+            raise RuntimeError('purge-alarm-history needs python3-aodh, '
+                               'available from Rocky')
+        kv = unitdata.kv()
+        checkpoint = hookenv.leader_get(PURGE_CHECKPOINT_KEY)
+        if older_than is not None:
+            before = (datetime.datetime.utcnow() -
+                      datetime.timedelta(days=older_than))
+            checkpoint = {'before': before.strftime('%Y-%m-%d %H:%M:%S'),
+                          'deleted': 0}
+        elif checkpoint:
+            checkpoint = json.loads(checkpoint)
+            # Progress made on this unit is more recent than leader settings
+            progress = kv.get(PURGE_PROGRESS_KEY)
+            if progress and progress['before'] == checkpoint['before']:
+                checkpoint = progress
+            hookenv.action_log(
+                'Resuming the purge of records before {before}, {deleted} '
+                'deleted so far'.format(**checkpoint))
+        else:
+            raise RuntimeError('older-than is needed, there is no '
+                               'interrupted purge to resume')
+        hookenv.leader_set({PURGE_CHECKPOINT_KEY: json.dumps(checkpoint)})
+        batch_size = (batch_size or
+                      self.config.get('alarm-history-delete-batch-size') or
+                      1000)
+        cmd = ['python3',
+               os.path.join(hookenv.charm_dir(), 'files',
+                            'aodh-purge-alarm-history'),
+               '--config-file', AODH_CONF,
+               '--before', checkpoint['before'],
+               '--batch-size', str(batch_size),
+               '--interval', str(interval)]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   universal_newlines=True)
+        for line in process.stdout:
+            checkpoint['deleted'] += json.loads(line)['deleted']
+            if not hookenv.is_leader():
+                process.terminate()
+                process.wait()
+                raise RuntimeError(
+                    'Leadership moved after {deleted} records were '
+                    'deleted; run the action again on the new leader to '
+                    'resume'.format(**checkpoint))
+            kv.set(PURGE_PROGRESS_KEY, checkpoint)
+            kv.flush()
+            hookenv.action_log('Deleted {deleted} records older than '
+                               '{before}'.format(**checkpoint))
+        if process.wait():
+            hookenv.leader_set(
+                {PURGE_CHECKPOINT_KEY: json.dumps(checkpoint)})
+            raise RuntimeError(
+                'Purge failed after {deleted} records were deleted; run the '
+                'action again to resume'.format(**checkpoint))
+        hookenv.leader_set({PURGE_CHECKPOINT_KEY: None})
+        kv.unset(PURGE_PROGRESS_KEY)
+        kv.flush()
+        return checkpoint
+
+    @staticmethod
+    def expirer_last_run():
+        """Duration, rows deleted and outcome of the last aodh-expirer run.
+
+        These are recorded by aodh-expirer-run, so that assessing the status
+        does not have to query systemd and the journal on every hook.
+
+        :returns: (seconds, rows, status) or None if it has not run yet
+        """
+        try:
+            with open(AODH_EXPIRER_LAST_RUN) as f:
+                last_run = json.load(f)
+            return last_run['seconds'], last_run['rows'], last_run['status']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def daemon_reload():
+        """Have systemd load changed unit files and drop-ins.
+
+        :returns: whether systemd is the init system
+        """
+        if not ch_host.init_is_systemd():
+            return False
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+        return True
+
+    @classmethod
+    def reload_and_restart(cls):
+        if cls.daemon_reload():
             ch_host.service_restart('aodh-api')
 
     def render_nrpe_checks(self):
@@ -140,25 +1423,104 @@ class AodhCharm(charms_openstack.plugins.PolicydOverridePlugin,
         charm_nrpe = nrpe.NRPE(hostname=hostname)
         nrpe.add_init_service_checks(
             charm_nrpe, self.services, current_unit)
+        nrpe.copy_nrpe_checks(
+            nrpe_files_dir=os.path.join(hookenv.charm_dir(), 'files', 'nrpe'))
+        memcache = reactive.endpoint_from_flag(
+            'coordinator-memcached.available')
+        if memcache:
+            charm_nrpe.add_check(
+                shortname='memcached_hit_rate',
+                description='keystone token cache hit rate {}'.format(
+                    current_unit),
+                check_cmd='{} -s {} -w {} -c {}'.format(
+                    os.path.join(NAGIOS_PLUGINS, 'check_memcached_hit_rate'),
+                    ','.join(memcached_servers(memcache)),
+                    self.config.get('memcached-hit-rate-warning'),
+                    self.config.get('memcached-hit-rate-critical')))
+        else:
+            charm_nrpe.remove_check(shortname='memcached_hit_rate')
+        charm_nrpe.add_check(
+            shortname='aodh_api_response_time',
+            description='aodh API response time {}'.format(current_unit),
+            check_cmd='{} -u {} -w {} -c {}'.format(
+                os.path.join(NAGIOS_PLUGINS, 'check_aodh_api_response_time'),
+                self.local_api_url(),
+                self.config.get('api-response-time-warning'),
+                self.config.get('api-response-time-critical')))
+        self.grant_log_access('nagios', AODH_LOG_DIR)
+        charm_nrpe.add_check(
+            shortname='aodh_evaluator_lag',
+            description='aodh evaluator cycle lag {}'.format(current_unit),
+            check_cmd='{} -w {} -c {}'.format(
+                os.path.join(NAGIOS_PLUGINS, 'check_aodh_evaluator_lag'),
+                self.config.get('evaluator-lag-warning'),
+                self.config.get('evaluator-lag-critical')))
+        if self.write_nagios_transport_url():
+            charm_nrpe.add_check(
+                shortname='aodh_notifier_queue_depth',
+                description='aodh notifier queue depth {}'.format(
+                    current_unit),
+                check_cmd='{} -f {} -q {} -w {} -c {}'.format(
+                    os.path.join(NAGIOS_PLUGINS, 'check_aodh_queue_depth'),
+                    NAGIOS_TRANSPORT_URL,
+                    ','.join(AODH_NOTIFIER_QUEUES),
+                    self.config.get('notifier-queue-depth-warning'),
+                    self.config.get('notifier-queue-depth-critical')))
+        else:
+            charm_nrpe.remove_check(shortname='aodh_notifier_queue_depth')
         charm_nrpe.write()
 
+    @staticmethod
+    def grant_log_access(user, directory):
+        """Let user read the logs in directory.
+
+        Rather than joining the user to adm, which reads every log on the
+        unit, ACLs are set on the one log directory.  The default ACL keeps
+        the logs that logrotate creates readable too.
+
+        :param user: the user to grant read access to
+        :param directory: the log directory
+        """
+        if not (ch_host.user_exists(user) and os.path.isdir(directory)):
+            return
+        ch_fetch.apt_install(ch_fetch.filter_installed_packages(['acl']),
+                             fatal=True)
+        subprocess.check_call(
+            ['setfacl', '-R', '-m', 'u:{}:rX'.format(user), directory])
+        subprocess.check_call(
+            ['setfacl', '-m', 'd:u:{}:rX'.format(user), directory])
+
+    def write_nagios_transport_url(self):
+        """Give the nagios user aodh's broker URL.
+
+        The transport_url is copied from aodh.conf into a file only the
+        nagios group can read.  The notifier queue lives on the notification
+        transport, which is the [DEFAULT] one unless notification-amqp is
+        related.
+
+        :returns: True if a transport_url was written
+        """
+        if not ch_host.user_exists('nagios'):
+            return False
+        sections = ini_sections(AODH_CONF) or {}
+        transport_url = (
+            sections.get('oslo_messaging_notifications', {}).get(
+                'transport_url') or
+            sections.get('DEFAULT', {}).get('transport_url'))
+        if not transport_url:
+            return False
+        ch_host.write_file(NAGIOS_TRANSPORT_URL, transport_url + '\n',
+                           owner='root', group='nagios', perms=0o640)
+        return True
+
 
 class AodhCharmNewton(AodhCharm):
     """Newton uses the aodh-api standalone systemd. If the systemd definition
-       changes the a systemctl daemon-reload is needed.
+       changes the a systemctl daemon-reload is needed, which
+       restart_on_change() does before restarting aodh-api.
     """
     release = 'newton'
 
-    def render_with_interfaces(self, interface_list):
-        if os.path.exists(AODH_API_SYSTEMD_CONF):
-            old_hash = ch_host.file_hash(AODH_API_SYSTEMD_CONF)
-        else:
-            old_hash = ''
-        super(AodhCharmNewton, self).render_with_interfaces(interface_list)
-        new_hash = ch_host.file_hash(AODH_API_SYSTEMD_CONF)
-        if old_hash != new_hash:
-            self.reload_and_restart()
-
 
 class AodhCharmOcata(AodhCharm):
     """From ocata onwards there is no aodh-api service, as this is handled via
@@ -174,19 +1536,29 @@ class AodhCharmOcata(AodhCharm):
     services = ['aodh-evaluator', 'aodh-notifier',
                 'aodh-listener', 'apache2']
 
+    # The API runs as a mod_wsgi daemon under apache2, which restarts its
+    # wsgi processes on a graceful reload.
+    daemon_services = {
+        'api': 'apache2',
+        'evaluator': 'aodh-evaluator',
+        'notifier': 'aodh-notifier',
+        'listener': 'aodh-listener',
+    }
+    reload_services = ['apache2', 'haproxy']
+
     # The restart map defines which services should be restarted when a given
     # file changes
     # Ocata onwards doesn't require aodh-api and the AODH_API_SYSTEMD_CONF
     # file.
     restart_map = {
         AODH_CONF: services,
-        AODH_WSGI_CONF: services,
+        AODH_WSGI_CONF: ['apache2'],
+        **AODH_DAEMON_RESOURCES
     }
 
-    @staticmethod
-    def reload_and_restart():
-        if ch_host.init_is_systemd():
-            subprocess.check_call(['systemctl', 'daemon-reload'])
+    @classmethod
+    def reload_and_restart(cls):
+        cls.daemon_reload()
         # no need to restart aodh-api in ocata and onwards
 
 
@@ -203,6 +1575,7 @@ class AodhCharmRocky(AodhCharmOcata):
         'aodh-listener',
         'python3-aodh',
         'libapache2-mod-wsgi-py3',
+        'python3-memcache',
         'python-apt',  # NOTE: workaround for hacluster suboridinate
     ]
 
@@ -226,10 +1599,12 @@ class AodhCharmVictoria(AodhCharmRocky):
         'aodh-listener',
         'python3-aodh',
         'libapache2-mod-wsgi-py3',
+        'python3-memcache',
         'python3-apt',  # NOTE: workaround for hacluster suboridinate
     ]
 
 
+@profiling.timed
 def install():
     """Use the singleton from the AodhCharm to install the packages on the
     unit
@@ -237,6 +1612,44 @@ def install():
     AodhCharm.singleton.install()
 
 
+@profiling.timed
+def configure_expirer():
+    """Use the singleton from the AodhCharm to schedule aodh-expirer
+    """
+    AodhCharm.singleton.configure_expirer()
+
+
+@profiling.timed
+def configure_exporter():
+    """Use the singleton from the AodhCharm to manage the metrics exporter
+    """
+    AodhCharm.singleton.configure_exporter()
+
+
+@profiling.timed
+def update_worker_rss():
+    """Use the singleton from the AodhCharm to sample the memory of the aodh
+    daemons
+    """
+    return AodhCharm.singleton.update_worker_rss()
+
+
+@profiling.timed
+def purge_alarm_history(older_than=None, batch_size=None, interval=1.0):
+    """Use the singleton from the AodhCharm to purge old alarm history
+    """
+    return AodhCharm.singleton.purge_alarm_history(older_than, batch_size,
+                                                   interval)
+
+
+@profiling.timed
+def benchmark_evaluator(alarms, cycles):
+    """Use the singleton from the AodhCharm to benchmark alarm evaluation
+    """
+    return AodhCharm.singleton.benchmark_evaluator(alarms, cycles)
+
+
+@profiling.timed
 def restart_all():
     """Use the singleton from the AodhCharm to restart services on the
     unit
@@ -244,12 +1657,30 @@ def restart_all():
     AodhCharm.singleton.restart_all()
 
 
+@profiling.timed
+def run_pending_restarts():
+    """Use the singleton from the AodhCharm to perform queued restarts
+    """
+    AodhCharm.singleton.run_pending_restarts()
+
+
+@profiling.timed
 def db_sync():
     """Use the singleton from the AodhCharm to run db migration
+
+    @returns: True if a migration ran
+    """
+    return AodhCharm.singleton.db_sync()
+
+
+@profiling.timed
+def db_sync_done():
+    """Use the singleton from the AodhCharm to check the migration state
     """
-    AodhCharm.singleton.db_sync()
+    return AodhCharm.singleton.db_sync_done()
 
 
+@profiling.timed
 def setup_endpoint(keystone):
     """When the keystone interface connects, register this unit in the keystone
     catalogue.
@@ -262,6 +1693,7 @@ def setup_endpoint(keystone):
                                 charm.admin_url)
 
 
+@profiling.timed
 def render_configs(interfaces_list):
     """Using a list of interfaces, render the configs and, if they have
     changes, restart the services on the unit.
@@ -270,24 +1702,43 @@ def render_configs(interfaces_list):
 
 
 def assess_status():
+    """Update the unit status once, at the end of the hook.
+
+    Several handlers may run in one hook and each asks for the status to be
+    updated, so the assessment is deferred to a single hookenv.atexit()
+    callback registered on the first request.
+    """
+    global _status_deferred
+    if not _status_deferred:
+        hookenv.atexit(assess_status_now)
+        _status_deferred = True
+
+
+@profiling.timed
+def assess_status_now():
     """Just call the AodhCharm.singleton.assess_status() command to update
     status on the unit.
     """
+    global _status_deferred
+    _status_deferred = False
     AodhCharm.singleton.assess_status()
 
 
+@profiling.timed
 def configure_ha_resources(hacluster):
     """Use the singleton from the AodhCharm to run configure_ha_resources
     """
     AodhCharm.singleton.configure_ha_resources(hacluster)
 
 
+@profiling.timed
 def configure_ssl():
     """Use the singleton from the AodhCharm to run configure_ssl
     """
     AodhCharm.singleton.configure_ssl()
 
 
+@profiling.timed
 def upgrade_if_available(interfaces_list):
     """Just call the AodhCharm.singleton.upgrade_if_available() command to
     update OpenStack package if upgrade is available
@@ -297,12 +1748,14 @@ def upgrade_if_available(interfaces_list):
     AodhCharm.singleton.upgrade_if_available(interfaces_list)
 
 
+@profiling.timed
 def reload_and_restart():
     """Reload systemd and restart aodh API when override file changes
     """
     AodhCharm.singleton.reload_and_restart()
 
 
+@profiling.timed
 def render_nrpe():
     """Render NRPE service monitors."""
     AodhCharm.singleton.render_nrpe_checks()
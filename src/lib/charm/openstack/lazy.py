@@ -0,0 +1,46 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deferred imports for modules only some hooks need.
+
+Every hook, including the frequent update-status, imports the handlers and
+the charm library, so modules used by only a few code paths are loaded on
+first attribute access instead.
+"""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Import a module, deferring its execution until first attribute access.
+
+    :param name: dotted name of the module
+    :returns: the module, or a placeholder that loads it when first used
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named {!r}'.format(name), name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
@@ -0,0 +1,180 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in timing of reactive handlers and charm library entry points.
+
+When the 'hook-profiling' option is set, the wall time of every reactive
+handler and of every function decorated with timed() is recorded and, at
+the end of the hook, appended as one JSON line to PROFILE_LOG under the
+charm directory.  With 'hook-profiling-cprofile' also set, cProfile stats
+for the outermost timed call are saved alongside it.  Both are rotated so
+that only the most recent MAX_HOOKS hooks are kept.
+"""
+
+import collections
+import functools
+import glob
+import json
+import os
+import time
+
+import charmhelpers.core.hookenv as hookenv
+
+import charms.reactive.bus as reactive_bus
+
+from charm.openstack.lazy import lazy_import
+
+cProfile = lazy_import('cProfile')
+
+PROFILE_DIR = 'profile'
+PROFILE_LOG = 'hooks.jsonl'
+MAX_HOOKS = 100
+
+_records = []
+_depth = 0
+_flush_scheduled = False
+
+
+def enabled():
+    """Whether hook profiling is switched on.
+
+    :returns: boolean
+    """
+    return hookenv.config('hook-profiling') is True
+
+
+def profile_dir():
+    """Directory under the charm holding the profile log and stats."""
+    return os.path.join(hookenv.charm_dir(), PROFILE_DIR)
+
+
+def _schedule_flush():
+    global _flush_scheduled
+    if not _flush_scheduled:
+        hookenv.atexit(flush)
+        _flush_scheduled = True
+
+
+def _record(name, started, profiler=None):
+    _schedule_flush()
+    _records.append((name, time.time() - started))
+    if profiler is not None:
+        os.makedirs(profile_dir(), exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir(), '{}-{}.prof'.format(
+            hookenv.hook_name(), int(started * 1000))))
+
+
+def call(name, func, *args, **kwargs):
+    """Call func, recording its wall time under name when profiling.
+
+    :param name: name the timing is recorded under
+    :param func: the callable to time
+    :returns: the result of func
+    """
+    global _depth
+    if not enabled():
+        return func(*args, **kwargs)
+    profiler = None
+    if _depth == 0 and hookenv.config('hook-profiling-cprofile') is True:
+        profiler = cProfile.Profile()
+    started = time.time()
+    _depth += 1
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, *args, **kwargs)
+        return func(*args, **kwargs)
+    finally:
+        _depth -= 1
+        _record(name, started, profiler)
+
+
+def timed(func):
+    """Decorator recording the wall time of func when profiling."""
+    name = '{}.{}'.format(func.__module__, func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return call(name, func, *args, **kwargs)
+    return wrapper
+
+
+def instrument_handlers():
+    """Time every reactive handler when profiling is enabled.
+
+    The handlers are timed at dispatch, via Handler.invoke, rather than by
+    wrapping them, as charms.reactive identifies handlers by their code
+    object.  The log is flushed from the first hookenv.atexit() callback
+    registered, so that it runs last and also records deferred work such as
+    the end-of-hook status assessment.
+    """
+    handler_class = reactive_bus.Handler
+    if not enabled() or getattr(handler_class.invoke, 'profiled', False):
+        return
+    _schedule_flush()
+    invoke = handler_class.invoke
+
+    def profiled_invoke(handler):
+        return call('handler:{}'.format(handler.id()), invoke, handler)
+    profiled_invoke.profiled = True
+    handler_class.invoke = profiled_invoke
+
+
+def flush():
+    """Append this hook's timings to the profile log and rotate it."""
+    global _records, _flush_scheduled
+    _flush_scheduled = False
+    if not _records:
+        return
+    os.makedirs(profile_dir(), exist_ok=True)
+    path = os.path.join(profile_dir(), PROFILE_LOG)
+    lines = []
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = f.readlines()
+    lines.append(json.dumps({
+        'hook': hookenv.hook_name(),
+        'time': int(time.time()),
+        'timings': _records,
+    }) + '\n')
+    with open(path, 'w') as f:
+        f.writelines(lines[-MAX_HOOKS:])
+    stats = sorted(glob.glob(os.path.join(profile_dir(), '*.prof')),
+                   key=os.path.getmtime)
+    for old in stats[:-MAX_HOOKS]:
+        os.remove(old)
+    _records = []
+
+
+def slowest(count=10):
+    """Summarise the recorded timings, slowest first.
+
+    :param count: number of entries to return
+    :returns: list of dicts with name, calls, total, max and mean seconds
+    """
+    path = os.path.join(profile_dir(), PROFILE_LOG)
+    totals = collections.defaultdict(list)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                for name, seconds in json.loads(line)['timings']:
+                    totals[name].append(seconds)
+    summary = [{
+        'name': name,
+        'calls': len(times),
+        'total': round(sum(times), 3),
+        'max': round(max(times), 3),
+        'mean': round(sum(times) / len(times), 3),
+    } for name, times in totals.items()]
+    summary.sort(key=lambda s: s['max'], reverse=True)
+    return summary[:count]
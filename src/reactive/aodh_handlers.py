@@ -12,19 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import charmhelpers.core.hookenv as hookenv
+
+import charms.coordinator as coordinator
 import charms.reactive as reactive
 
 import charms_openstack.charm as charm
 
 # This charm's library contains all of the handler code associated with
-# aodh
+# aodh.  It is imported eagerly as it registers the release classes and the
+# default handlers; modules it only needs on some code paths are deferred.
 import charm.openstack.aodh as aodh
+import charm.openstack.profiling as profiling
 
 charm.use_defaults(
     'certificates.available',
     'cluster.available',
 )
 
+# Time every handler when the hook-profiling option is set
+profiling.instrument_handlers()
+
 
 # Minimal inferfaces required for operation
 MINIMAL_INTERFACES = [
@@ -33,6 +41,13 @@ MINIMAL_INTERFACES = [
     'amqp.available',
 ]
 
+# Optional interfaces which are passed to the renderer when available
+OPTIONAL_INTERFACES = [
+    'coordinator-memcached.available',
+    'notification-amqp.available',
+    'shared-db-read-only.available',
+]
+
 
 # use a synthetic state to ensure that it get it to be installed independent of
 # the install hook.
@@ -52,6 +67,14 @@ def setup_amqp_req(amqp):
     aodh.assess_status()
 
 
+@reactive.when('notification-amqp.connected')
+def setup_notification_amqp_req(amqp):
+    """Request access to the broker aodh should use for notifications."""
+    amqp.request_access(username='aodh',
+                        vhost=hookenv.config('notification-amqp-vhost'))
+    aodh.assess_status()
+
+
 @reactive.when('shared-db.connected')
 def setup_database(database):
     """On receiving database credentials, configure the database on the
@@ -61,6 +84,13 @@ def setup_database(database):
     aodh.assess_status()
 
 
+@reactive.when('shared-db-read-only.connected')
+def setup_read_only_database(database):
+    """Request credentials for the read-only database endpoint."""
+    database.configure('aodh', 'aodh')
+    aodh.assess_status()
+
+
 @reactive.when('identity-service.connected')
 def setup_endpoint(keystone):
     aodh.setup_endpoint(keystone)
@@ -69,6 +99,10 @@ def setup_endpoint(keystone):
 
 
 def render(*args):
+    args = args + tuple(
+        reactive.endpoint_from_flag(flag)
+        for flag in OPTIONAL_INTERFACES
+        if reactive.is_flag_set(flag))
     aodh.render_configs(args)
     reactive.set_state('config.complete')
     aodh.assess_status()
@@ -95,12 +129,57 @@ def render_clustered(*args):
 @reactive.when('config.complete')
 @reactive.when_not('db.synced')
 def run_db_migration():
-    aodh.db_sync()
-    aodh.restart_all()
-    reactive.set_state('db.synced')
+    """Migrate on the leader; followers wait for it via leader settings."""
+    if aodh.db_sync():
+        aodh.restart_all()
+    if aodh.db_sync_done():
+        reactive.set_state('db.synced')
     aodh.assess_status()
 
 
+@reactive.when('db.synced')
+@reactive.when_not('is-update-status-hook')
+def check_db_revision():
+    """Migrate again once an upgraded package brings a new schema head."""
+    if not aodh.db_sync_done():
+        reactive.clear_flag('db.synced')
+
+
+@reactive.when('config.complete')
+@reactive.when_not('is-update-status-hook')
+def configure_expirer():
+    """Schedule alarm history expiry on the leader."""
+    aodh.configure_expirer()
+
+
+@reactive.when('config.complete')
+@reactive.when_not('is-update-status-hook')
+def configure_exporter():
+    """Run the metrics exporter while metrics-endpoint is related."""
+    aodh.configure_exporter()
+
+
+@reactive.when('config.complete')
+def update_worker_rss():
+    """Sample the memory of the aodh daemons for memory-aware API sizing."""
+    aodh.update_worker_rss()
+
+
+@reactive.when('aodh.restart.pending')
+@reactive.when_not('coordinator.granted.restart')
+def request_restart():
+    """Ask the leader for the rolling restart lock."""
+    coordinator.acquire('restart')
+
+
+@reactive.when('aodh.restart.pending',
+               'coordinator.granted.restart')
+def rolling_restart():
+    """Restart the queued services while holding the restart lock."""
+    aodh.run_pending_restarts()
+    reactive.clear_flag('aodh.restart.pending')
+
+
 @reactive.when('ha.connected')
 def cluster_connected(hacluster):
     aodh.configure_ha_resources(hacluster)
@@ -22,3 +22,5 @@ sys.path.append('src/lib')
 import charms_openstack.test_mocks  # noqa
 charms_openstack.test_mocks.mock_charmhelpers()
 sys.modules['charmhelpers.contrib.charmsupport.nrpe'] = mock.MagicMock()
+# charms.coordinator is provided by layer:coordinator at build time
+sys.modules['charms.coordinator'] = mock.MagicMock()
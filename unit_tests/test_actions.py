@@ -0,0 +1,81 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from unittest import mock
+
+import charms_openstack.test_utils as test_utils
+
+# charms.layer is only available in the built charm
+with mock.patch.dict(sys.modules, {'charms.layer': mock.MagicMock()}):
+    import actions.actions as actions
+
+
+class TestAodhActions(test_utils.PatchHelper):
+
+    def test_main_unknown_action(self):
+        self.assertEqual(actions.main(['unknown']),
+                         'Action unknown undefined')
+
+    def test_main_action_fails(self):
+        self.patch_object(actions.hookenv, 'action_fail')
+        self.patch_object(actions, 'slowest_handlers',
+                          side_effect=Exception('boom'))
+        with mock.patch.dict(actions.ACTIONS,
+                             {'slowest-handlers': actions.slowest_handlers}):
+            actions.main(['actions/slowest-handlers'])
+        self.action_fail.assert_called_once_with('boom')
+
+    def test_slowest_handlers(self):
+        self.patch_object(actions.hookenv, 'action_get', return_value=5)
+        self.patch_object(actions.hookenv, 'action_set')
+        self.patch_object(actions.profiling, 'slowest',
+                          return_value=[{'name': 'a'}])
+        actions.slowest_handlers([])
+        self.slowest.assert_called_once_with(5)
+        self.action_set.assert_called_once_with(
+            {'slowest': '[\n  {\n    "name": "a"\n  }\n]'})
+
+    def test_slowest_handlers_none_recorded(self):
+        self.patch_object(actions.hookenv, 'action_get', return_value=5)
+        self.patch_object(actions.hookenv, 'action_fail')
+        self.patch_object(actions.hookenv, 'action_set')
+        self.patch_object(actions.profiling, 'slowest', return_value=[])
+        actions.slowest_handlers([])
+        self.action_fail.assert_called_once()
+        self.action_set.assert_not_called()
+
+    def test_benchmark_evaluator(self):
+        self.patch_object(actions.hookenv, 'action_get',
+                          side_effect=lambda key: {'alarms': 200,
+                                                   'cycles': 3}[key])
+        self.patch_object(actions.hookenv, 'action_set')
+        self.patch_object(actions.aodh, 'benchmark_evaluator',
+                          return_value={'evaluation-rate': 120.5})
+        actions.benchmark_evaluator([])
+        self.benchmark_evaluator.assert_called_once_with(200, 3)
+        self.action_set.assert_called_once_with({'evaluation-rate': 120.5})
+
+    def test_purge_alarm_history(self):
+        self.patch_object(actions.hookenv, 'action_get',
+                          side_effect=lambda key: {'older-than': 30,
+                                                   'interval': 1.0}.get(key))
+        self.patch_object(actions.hookenv, 'action_set')
+        self.patch_object(actions.aodh, 'purge_alarm_history',
+                          return_value={'before': '2026-09-18 00:00:00',
+                                        'deleted': 5000})
+        actions.purge_alarm_history([])
+        self.purge_alarm_history.assert_called_once_with(30, None, 1.0)
+        self.action_set.assert_called_once_with(
+            {'before': '2026-09-18 00:00:00', 'deleted': 5000})
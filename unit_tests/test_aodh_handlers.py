@@ -35,7 +35,11 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
         hook_set = {
             'when': {
                 'setup_amqp_req': ('amqp.connected', ),
+                'setup_notification_amqp_req': (
+                    'notification-amqp.connected', ),
                 'setup_database': ('shared-db.connected', ),
+                'setup_read_only_database': (
+                    'shared-db-read-only.connected', ),
                 'setup_endpoint': ('identity-service.connected', ),
                 'render_unclustered': ('charm.installed',
                                        'shared-db.available',
@@ -50,11 +54,22 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
                                      'config.complete', ),
                 'cluster_connected': ('ha.connected', ),
                 'configure_nrpe': ('config.complete', ),
+                'configure_expirer': ('config.complete', ),
+                'configure_exporter': ('config.complete', ),
+                'check_db_revision': ('db.synced', ),
+                'update_worker_rss': ('config.complete', ),
+                'request_restart': ('aodh.restart.pending', ),
+                'rolling_restart': ('aodh.restart.pending',
+                                    'coordinator.granted.restart', ),
             },
             'when_not': {
                 'install_packages': ('charm.installed', ),
                 'render_unclustered': ('cluster.available', ),
                 'run_db_migration': ('db.synced', ),
+                'configure_expirer': ('is-update-status-hook', ),
+                'configure_exporter': ('is-update-status-hook', ),
+                'check_db_revision': ('is-update-status-hook', ),
+                'request_restart': ('coordinator.granted.restart', ),
             },
             'when_none': {
                 'configure_nrpe': ('charm.paused', 'is-update-status-hook', ),
@@ -125,12 +140,27 @@ class TestAodhHandlers(unittest.TestCase):
         amqp.request_access.assert_called_once_with(
             username='aodh', vhost='openstack')
 
+    def test_setup_notification_amqp_req(self):
+        self.patch(handlers.aodh, 'assess_status')
+        self.patch(handlers.hookenv, 'config', return_value='alarming')
+        amqp = mock.MagicMock()
+        handlers.setup_notification_amqp_req(amqp)
+        self.config.assert_called_once_with('notification-amqp-vhost')
+        amqp.request_access.assert_called_once_with(
+            username='aodh', vhost='alarming')
+
     def test_database(self):
         database = mock.MagicMock()
         self.patch(handlers.aodh, 'assess_status')
         handlers.setup_database(database)
         database.configure.assert_called_once_with('aodh', 'aodh')
 
+    def test_setup_read_only_database(self):
+        database = mock.MagicMock()
+        self.patch(handlers.aodh, 'assess_status')
+        handlers.setup_read_only_database(database)
+        database.configure.assert_called_once_with('aodh', 'aodh')
+
     def test_setup_endpoint(self):
         self.patch(handlers.aodh, 'setup_endpoint')
         self.patch(handlers.aodh, 'assess_status')
@@ -143,8 +173,77 @@ class TestAodhHandlers(unittest.TestCase):
         self.patch(handlers.aodh, 'assess_status')
         self.patch(handlers.aodh, 'configure_ssl')
         self.patch(handlers.aodh, 'upgrade_if_available')
+        self.patch(handlers.reactive, 'is_flag_set', return_value=False)
         handlers.render_unclustered('arg1', 'arg2')
         self.render_configs.assert_called_once_with(('arg1', 'arg2', ))
         self.assess_status.assert_called_once()
         self.configure_ssl.assert_called_once()
         self.upgrade_if_available.assert_called_once_with(('arg1', 'arg2', ))
+
+    def test_render_optional_interfaces(self):
+        self.patch(handlers.aodh, 'render_configs')
+        self.patch(handlers.aodh, 'assess_status')
+        self.patch(handlers.reactive, 'set_state')
+        self.patch(handlers.reactive, 'is_flag_set', return_value=True)
+        self.patch(handlers.reactive, 'endpoint_from_flag',
+                   side_effect=['memcached', 'notification-amqp',
+                                'shared-db-read-only'])
+        handlers.render('arg1')
+        self.endpoint_from_flag.assert_has_calls([
+            mock.call('coordinator-memcached.available'),
+            mock.call('notification-amqp.available'),
+            mock.call('shared-db-read-only.available'),
+        ])
+        self.render_configs.assert_called_once_with(
+            ('arg1', 'memcached', 'notification-amqp',
+             'shared-db-read-only', ))
+
+    def test_run_db_migration(self):
+        self.patch(handlers.aodh, 'db_sync', return_value=True)
+        self.patch(handlers.aodh, 'db_sync_done', return_value=True)
+        self.patch(handlers.aodh, 'restart_all')
+        self.patch(handlers.aodh, 'assess_status')
+        self.patch(handlers.reactive, 'set_state')
+        handlers.run_db_migration()
+        self.restart_all.assert_called_once_with()
+        self.set_state.assert_called_once_with('db.synced')
+
+    def test_run_db_migration_follower(self):
+        self.patch(handlers.aodh, 'db_sync', return_value=False)
+        self.patch(handlers.aodh, 'db_sync_done', return_value=False)
+        self.patch(handlers.aodh, 'restart_all')
+        self.patch(handlers.aodh, 'assess_status')
+        self.patch(handlers.reactive, 'set_state')
+        handlers.run_db_migration()
+        self.restart_all.assert_not_called()
+        self.set_state.assert_not_called()
+        self.db_sync_done.return_value = True
+        handlers.run_db_migration()
+        self.restart_all.assert_not_called()
+        self.set_state.assert_called_once_with('db.synced')
+
+    def test_update_worker_rss(self):
+        self.patch(handlers.aodh, 'update_worker_rss')
+        handlers.update_worker_rss()
+        self.update_worker_rss.assert_called_once_with()
+
+    def test_check_db_revision(self):
+        self.patch(handlers.aodh, 'db_sync_done', return_value=True)
+        self.patch(handlers.reactive, 'clear_flag')
+        handlers.check_db_revision()
+        self.clear_flag.assert_not_called()
+        self.db_sync_done.return_value = False
+        handlers.check_db_revision()
+        self.clear_flag.assert_called_once_with('db.synced')
+
+    def test_request_restart(self):
+        self.patch(handlers.coordinator, 'acquire')
+        handlers.request_restart()
+        self.acquire.assert_called_once_with('restart')
+
+    def test_rolling_restart(self):
+        self.patch(handlers.aodh, 'run_pending_restarts')
+        self.patch(handlers.reactive, 'clear_flag')
+        handlers.rolling_restart()
+        self.run_pending_restarts.assert_called_once_with()
+        self.clear_flag.assert_called_once_with('aodh.restart.pending')
@@ -0,0 +1,174 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib.machinery
+import importlib.util
+import io
+import json
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(__file__),
+                      '..', 'src', 'files', 'aodh-benchmark-evaluator')
+
+
+def load_script():
+    """Import the extensionless benchmark script as a module."""
+    loader = importlib.machinery.SourceFileLoader('benchmark', SCRIPT)
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader('benchmark', loader))
+    loader.exec_module(module)
+    return module
+
+
+class Alarm(object):
+    """Stand-in for an older aodh Alarm model, without newer fields."""
+
+    def __init__(self, alarm_id, type, enabled, name, description,
+                 timestamp, user_id, project_id, state, state_timestamp,
+                 ok_actions, alarm_actions, insufficient_data_actions,
+                 repeat_actions, rule, time_constraints, severity=None):
+        self.alarm_id = alarm_id
+        self.enabled = enabled
+        self.rule = rule
+
+
+def aodh_modules(storage_conn, dispatched):
+    """Stub aodh and stevedore modules that run() imports.
+
+    The evaluator notifies whenever the statistics cross the threshold, and
+    the alarm endpoint, like aodh's, only offers sample().
+    """
+    class Evaluator(object):
+
+        def __init__(self, conf):
+            self.notifier = mock.MagicMock()
+
+        def evaluate(self, alarm):
+            value = self._statistics(alarm.rule, 0, 60)[-1][2]
+            self.notifier.notifier.sample(
+                {}, 'alarm.update',
+                {'alarm_id': alarm.alarm_id,
+                 'current': 'alarm' if value > alarm.rule['threshold']
+                 else 'ok'})
+
+    class AlarmEndpoint(object):
+
+        def __init__(self, notifiers):
+            self.notifiers = notifiers
+
+        def sample(self, notifications):
+            dispatched.extend(n['payload'] for n in notifications)
+
+    modules = {
+        'aodh': types.ModuleType('aodh'),
+        'aodh.notifier': types.ModuleType('aodh.notifier'),
+        'aodh.service': types.ModuleType('aodh.service'),
+        'aodh.storage': types.ModuleType('aodh.storage'),
+        'aodh.storage.models': types.ModuleType('aodh.storage.models'),
+        'aodh.evaluator': types.ModuleType('aodh.evaluator'),
+        'aodh.evaluator.gnocchi': types.ModuleType('aodh.evaluator.gnocchi'),
+        'stevedore': types.ModuleType('stevedore'),
+        'stevedore.extension': mock.MagicMock(),
+    }
+    modules['aodh.notifier'].AlarmEndpoint = AlarmEndpoint
+    modules['aodh.service'].prepare_service = mock.MagicMock()
+    modules['aodh.storage'].get_connection_from_config = mock.MagicMock(
+        return_value=storage_conn)
+    modules['aodh.storage'].models = modules['aodh.storage.models']
+    modules['aodh.storage.models'].Alarm = Alarm
+    modules['aodh.evaluator'].gnocchi = modules['aodh.evaluator.gnocchi']
+    gnocchi = modules['aodh.evaluator.gnocchi']
+    gnocchi.GnocchiAggregationMetricsThresholdEvaluator = Evaluator
+    modules['stevedore'].extension = modules['stevedore.extension']
+    for name in ('notifier', 'service', 'storage', 'evaluator'):
+        setattr(modules['aodh'], name, modules['aodh.{}'.format(name)])
+    return modules
+
+
+class TestBenchmarkEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.benchmark = load_script()
+
+    def test_percentile(self):
+        samples = list(range(100, 0, -1))
+        self.assertEqual(self.benchmark.percentile(samples, 50), 50)
+        self.assertEqual(self.benchmark.percentile(samples, 99), 99)
+        self.assertEqual(self.benchmark.percentile([7], 95), 7)
+
+    def test_summarise(self):
+        self.assertEqual(self.benchmark.summarise('cycle', []), {})
+        self.assertEqual(
+            self.benchmark.summarise('evaluation', [0.001, 0.003]),
+            {'evaluation-rate': 500.0,
+             'evaluation-max-ms': 3.0,
+             'evaluation-p50-ms': 1.0,
+             'evaluation-p95-ms': 3.0,
+             'evaluation-p99-ms': 3.0})
+        self.assertNotIn('cycle-rate',
+                         self.benchmark.summarise('cycle', [1.0],
+                                                  rate=False))
+
+    def test_synthetic_alarm(self):
+        models = mock.MagicMock(Alarm=Alarm)
+        alarm = self.benchmark.synthetic_alarm(models, 'project', 'user', 3)
+        self.assertFalse(alarm.enabled)
+        self.assertEqual(alarm.rule['threshold'], self.benchmark.THRESHOLD)
+
+    def test_main(self):
+        with mock.patch.object(self.benchmark, 'run',
+                               return_value={'alarms': 10}) as run, \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual(self.benchmark.main(['--alarms', '10']), 0)
+        run.assert_called_once_with('/etc/aodh/aodh.conf', 10, 5)
+        self.assertEqual(json.loads(out.getvalue()), {'alarms': 10})
+        with mock.patch('sys.stderr', new_callable=io.StringIO):
+            with self.assertRaises(SystemExit):
+                self.benchmark.main(['--cycles', '0'])
+
+    def test_run(self):
+        conn = mock.MagicMock()
+        conn.create_alarm.side_effect = lambda alarm: alarm
+        dispatched = []
+        with mock.patch.dict(sys.modules, aodh_modules(conn, dispatched)):
+            results = self.benchmark.run('/etc/aodh/aodh.conf', 3, 2)
+        self.assertEqual(results['alarms'], 3)
+        self.assertEqual(results['notifications'], 6)
+        self.assertEqual(len(dispatched), 6)
+        self.assertEqual([p['current'] for p in dispatched],
+                         ['alarm'] * 3 + ['ok'] * 3)
+        for key in ('cycle-p50-ms', 'evaluation-rate', 'dispatch-rate',
+                    'dispatch-p99-ms'):
+            self.assertIn(key, results)
+        self.assertEqual(conn.create_alarm.call_count, 3)
+        self.assertEqual(
+            sorted(c[0][0] for c in conn.delete_alarm.call_args_list),
+            sorted(c[0][0].alarm_id for c in conn.create_alarm.call_args_list))
+
+    def test_run_deletes_alarms_on_failure(self):
+        conn = mock.MagicMock()
+        conn.create_alarm.side_effect = lambda alarm: alarm
+        modules = aodh_modules(conn, [])
+        endpoint = mock.MagicMock()
+        endpoint.sample.side_effect = RuntimeError('dispatch failed')
+        modules['aodh.notifier'].AlarmEndpoint = mock.MagicMock(
+            return_value=endpoint)
+        with mock.patch.dict(sys.modules, modules):
+            with self.assertRaises(RuntimeError):
+                self.benchmark.run('/etc/aodh/aodh.conf', 2, 1)
+        self.assertEqual(conn.delete_alarm.call_count, 2)
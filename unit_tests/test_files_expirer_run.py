@@ -0,0 +1,112 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib.machinery
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(__file__),
+                      '..', 'src', 'files', 'aodh-expirer-run')
+
+
+def load_script():
+    """Import the extensionless expirer wrapper as a module."""
+    loader = importlib.machinery.SourceFileLoader('expirer_run', SCRIPT)
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader('expirer_run', loader))
+    loader.exec_module(module)
+    return module
+
+
+class TestExpirerRun(unittest.TestCase):
+
+    def setUp(self):
+        self.run = load_script()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.expirer = os.path.join(self.tmp, 'aodh-expirer')
+        self.last_run = os.path.join(self.tmp, 'last-run.json')
+        for name, value in (('EXPIRER', self.expirer),
+                            ('LAST_RUN', self.last_run)):
+            patcher = mock.patch.object(self.run, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.run.signal, 'signal')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_expirer(self, script):
+        with open(self.expirer, 'w') as f:
+            f.write('#!/bin/sh\n' + script)
+        os.chmod(self.expirer, 0o755)
+
+    def test_records_rows(self):
+        self.fake_expirer(
+            'echo "100 alarm histories are removed from database"\n'
+            'echo "25 alarm histories are removed from database" >&2\n')
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual(self.run.main([]), 0)
+        self.assertIn('25 alarm histories', out.getvalue())
+        with open(self.last_run) as f:
+            last_run = json.load(f)
+        self.assertEqual((last_run['rows'], last_run['status']), (125, 'ok'))
+
+    def test_records_failure(self):
+        self.fake_expirer('exit 1\n')
+        self.assertEqual(self.run.main([]), 1)
+        with open(self.last_run) as f:
+            self.assertEqual(json.load(f)['status'], 'failed')
+
+    def test_repeats_full_batches(self):
+        # Removes a full batch of 100 twice, then the last 40
+        count = os.path.join(self.tmp, 'count')
+        self.fake_expirer(
+            'echo x >> {0}\n'
+            'if [ $(wc -l < {0}) -lt 3 ]; then n=100; else n=40; fi\n'
+            'echo "$n alarm histories are removed from database"\n'
+            .format(count))
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(self.run.main(['--batch-size', '100']), 0)
+        with open(self.last_run) as f:
+            last_run = json.load(f)
+        self.assertEqual((last_run['rows'], last_run['status']), (240, 'ok'))
+        with open(count) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_window(self):
+        self.fake_expirer(
+            'echo "100 alarm histories are removed from database"\n')
+        with mock.patch.object(self.run.time, 'time',
+                               side_effect=[0, 0, 40, 40, 80, 80]), \
+                mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(
+                self.run.main(['--batch-size', '100', '--window', '100']), 0)
+        with open(self.last_run) as f:
+            last_run = json.load(f)
+        self.assertEqual((last_run['rows'], last_run['status']),
+                         (200, 'incomplete'))
+
+    def test_single_invocation_without_batches(self):
+        self.fake_expirer(
+            'echo "100 alarm histories are removed from database"\n')
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(self.run.main([]), 0)
+        with open(self.last_run) as f:
+            self.assertEqual(json.load(f)['rows'], 100)
@@ -0,0 +1,191 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib.machinery
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(__file__),
+                      '..', 'src', 'files', 'aodh-exporter')
+
+ACCESS_LOG = (
+    '10.0.0.1 - - [01/Jan/2024:12:00:00 +0000] "GET /v2/alarms HTTP/1.1" '
+    '200 512 "-" "python-aodhclient" 120000\n'
+    '10.0.0.1 - - [01/Jan/2024:12:00:01 +0000] "POST /v2/alarms HTTP/1.1" '
+    '201 512 "-" "python-aodhclient" 3000000\n'
+    '10.0.0.1 - - [01/Jan/2024:12:00:02 +0000] "GET / HTTP/1.1" '
+    '200 64 "-" "haproxy"\n'
+    'not an access log line\n')
+
+EVALUATOR_LOG = (
+    '2024-01-01 12:00:00.100 101 INFO aodh.evaluator [-] initiating '
+    'evaluation cycle on 10 alarms\n'
+    '2024-01-01 12:00:01.200 102 INFO aodh.evaluator [-] initiating '
+    'evaluation cycle on 12 alarms\n'
+    '2024-01-01 12:01:00.100 101 INFO aodh.evaluator [-] initiating '
+    'evaluation cycle on 11 alarms\n'
+    '2024-01-01 12:01:00.300 103 INFO aodh.evaluator [-] initiating '
+    'evaluation cycle on 9 alarms\n'
+    '2024-01-01 12:01:01.000 102 INFO aodh.evaluator [-] initiating '
+    'evaluation cycle on 12 alarms\n')
+
+
+def load_script():
+    """Import the extensionless exporter as a module, with psutil mocked."""
+    loader = importlib.machinery.SourceFileLoader('exporter', SCRIPT)
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader('exporter', loader))
+    with mock.patch.dict(sys.modules, {'psutil': mock.MagicMock()}):
+        loader.exec_module(module)
+    module.psutil.Error = Exception
+    return module
+
+
+def process(pid, cmdline, rss, cpu):
+    p = mock.MagicMock(pid=pid, info={'cmdline': cmdline})
+    p.memory_info.return_value.rss = rss
+    p.cpu_times.return_value = (cpu, 0.5, 0.0, 0.0)
+    return p
+
+
+class TestExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.exporter = load_script()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.access_log = os.path.join(self.tmp, 'aodh_access.log')
+        self.evaluator_log = os.path.join(self.tmp, 'aodh-evaluator.log')
+        self.args = self.exporter.parse_args([
+            '--access-log', self.access_log,
+            '--evaluator-log', self.evaluator_log])
+        self.collector = self.exporter.Collector(self.args)
+        self.exporter.psutil.pid_exists.return_value = True
+
+    def write(self, path, content, mode='a'):
+        with open(path, mode) as f:
+            f.write(content)
+
+    def test_parse_args(self):
+        self.assertEqual(self.args.address, '127.0.0.1')
+        self.assertEqual(self.args.port, 9650)
+        self.assertFalse(self.args.database)
+        args = self.exporter.parse_args(['--address', '::1', '--database'])
+        self.assertEqual(args.address, '::1')
+        self.assertTrue(args.database)
+
+    def test_log_tail(self):
+        tail = self.exporter.LogTail(self.access_log)
+        self.assertEqual(tail.lines(), [])
+        self.write(self.access_log, 'one\ntwo\nthr')
+        self.assertEqual(tail.lines(), ['one', 'two'])
+        self.write(self.access_log, 'ee\n')
+        self.assertEqual(tail.lines(), ['three'])
+        # rotated and truncated
+        self.write(self.access_log, 'four\n', mode='w')
+        self.assertEqual(tail.lines(), ['four'])
+
+    def test_read_access_log(self):
+        self.write(self.access_log, ACCESS_LOG)
+        self.collector.read_access_log()
+        self.assertEqual(dict(self.collector.requests),
+                         {('GET', '200'): 2, ('POST', '201'): 1})
+        self.assertEqual(self.collector.latency_count, 2)
+        self.assertAlmostEqual(self.collector.latency_sum, 3.12)
+        self.assertEqual(self.collector.buckets[0.25], 1)
+        self.assertEqual(self.collector.buckets[5.0], 2)
+
+    def test_read_evaluator_log(self):
+        self.write(self.evaluator_log, EVALUATOR_LOG)
+        self.collector.read_evaluator_log()
+        cycles = self.collector.cycles
+        self.assertEqual(sorted(cycles), [101, 102, 103])
+        self.assertEqual(cycles[101][1][0] - cycles[101][0][0], 60)
+        self.assertEqual(cycles[102][1][0] - cycles[102][0][0], 60)
+        self.assertEqual(len(cycles[103]), 1)
+        # workers that exited are forgotten
+        self.exporter.psutil.pid_exists.side_effect = lambda pid: pid != 103
+        self.collector.read_evaluator_log()
+        self.assertEqual(sorted(self.collector.cycles), [101, 102])
+
+    def test_daemon_usage(self):
+        self.exporter.psutil.process_iter.return_value = [
+            process(11, ['/usr/bin/python3', '/usr/bin/aodh-evaluator'],
+                    100, 2.0),
+            process(12, ['/usr/bin/python3', '/usr/bin/aodh-evaluator'],
+                    200, 3.0),
+            process(13, ['(wsgi:aodh-api)', '-k', 'start'], 300, 4.0),
+            process(os.getpid(), ['aodh-exporter', '--evaluator-log',
+                                  '/var/log/aodh/aodh-evaluator.log'],
+                    400, 5.0),
+            process(14, ['/usr/sbin/sshd'], 500, 6.0),
+        ]
+        self.assertEqual(self.exporter.Collector.daemon_usage(), [
+            ('api', 13, 300, 4.5),
+            ('evaluator', 11, 100, 2.5),
+            ('evaluator', 12, 200, 3.5),
+        ])
+
+    def test_render(self):
+        self.write(self.access_log, ACCESS_LOG)
+        self.write(self.evaluator_log, EVALUATOR_LOG)
+        self.collector.read_access_log()
+        self.collector.read_evaluator_log()
+        lines = self.collector.render([
+            ('evaluator', 11, 100, 2.5),
+            ('evaluator', 12, 200, 3.5),
+        ]).splitlines()
+        self.assertIn('aodh_api_requests_total{method="GET",code="200"} 2',
+                      lines)
+        self.assertIn('aodh_api_request_duration_seconds_bucket{le="+Inf"} 2',
+                      lines)
+        self.assertIn('aodh_evaluator_cycle_interval_seconds{pid="101"} 60',
+                      lines)
+        self.assertIn('aodh_evaluator_cycle_interval_seconds{pid="102"} 60',
+                      lines)
+        # a worker's interval needs two of its cycles
+        self.assertFalse([line for line in lines if line.startswith(
+            'aodh_evaluator_cycle_interval_seconds{pid="103"}')])
+        self.assertIn('aodh_evaluator_cycle_alarms{pid="103"} 9', lines)
+        self.assertIn('aodh_processes{daemon="evaluator"} 2', lines)
+        self.assertIn('aodh_processes{daemon="api"} 0', lines)
+        self.assertIn(
+            'aodh_process_resident_memory_bytes{daemon="evaluator"} 300',
+            lines)
+        self.assertIn(
+            'aodh_process_cpu_seconds_total{daemon="evaluator",pid="12"} 3.5',
+            lines)
+        self.assertFalse([line for line in lines
+                          if line.startswith('aodh_alarms')])
+
+    def test_collect_database(self):
+        args = self.exporter.parse_args([
+            '--access-log', self.access_log,
+            '--evaluator-log', self.evaluator_log,
+            '--database'])
+        collector = self.exporter.Collector(args)
+        self.exporter.psutil.process_iter.return_value = []
+        with mock.patch.object(collector, 'read_database',
+                               side_effect=lambda: setattr(
+                                   collector, 'database',
+                                   {'states': {'ok': 3, 'alarm': 1},
+                                    'history': 42})):
+            lines = collector.collect().splitlines()
+        self.assertIn('aodh_alarms{state="alarm"} 1', lines)
+        self.assertIn('aodh_alarm_history_rows 42', lines)
@@ -0,0 +1,159 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import http.server
+import importlib.machinery
+import importlib.util
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+NRPE_FILES = os.path.join(os.path.dirname(__file__),
+                          '..', 'src', 'files', 'nrpe')
+
+
+def load_check(name):
+    """Import one of the extensionless NRPE check scripts as a module."""
+    loader = importlib.machinery.SourceFileLoader(
+        name, os.path.join(NRPE_FILES, name))
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
+
+
+class VersionHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"versions": {}}')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCheckApiResponseTime(unittest.TestCase):
+
+    def setUp(self):
+        self.check = load_check('check_aodh_api_response_time')
+        self.server = http.server.HTTPServer(('127.0.0.1', 0),
+                                             VersionHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def test_ok(self):
+        self.assertEqual(self.check.main(['-u', self.url]), self.check.OK)
+
+    def test_slow(self):
+        self.assertEqual(self.check.main(['-u', self.url, '-w', '0',
+                                          '-c', '10']),
+                         self.check.WARNING)
+        self.assertEqual(self.check.main(['-u', self.url, '-w', '0',
+                                          '-c', '0']),
+                         self.check.CRITICAL)
+
+    def test_unreachable(self):
+        self.server.server_close()
+        self.assertEqual(self.check.main(['-u', self.url, '-t', '1']),
+                         self.check.CRITICAL)
+
+
+class TestCheckEvaluatorLag(unittest.TestCase):
+
+    def setUp(self):
+        self.check = load_check('check_aodh_evaluator_lag')
+        log = tempfile.NamedTemporaryFile('w', delete=False)
+        self.addCleanup(os.remove, log.name)
+        self.log = log
+        self.log.close()
+
+    def write_cycle(self, seconds_ago):
+        started = datetime.datetime.now() - datetime.timedelta(
+            seconds=seconds_ago)
+        with open(self.log.name, 'a') as f:
+            f.write('{}.123 1234 INFO aodh.evaluator [-] initiating '
+                    'evaluation cycle on 3 alarms\n'.format(
+                        started.strftime('%Y-%m-%d %H:%M:%S')))
+            f.write('{}.456 1234 INFO aodh.evaluator [-] other\n'.format(
+                started.strftime('%Y-%m-%d %H:%M:%S')))
+
+    def test_lag(self):
+        self.write_cycle(400)
+        self.assertEqual(self.check.main(['-l', self.log.name]),
+                         self.check.WARNING)
+        self.write_cycle(1000)
+        self.write_cycle(10)
+        self.assertEqual(self.check.main(['-l', self.log.name]),
+                         self.check.OK)
+        self.assertEqual(self.check.main(['-l', self.log.name,
+                                          '-w', '1', '-c', '5']),
+                         self.check.CRITICAL)
+
+    def test_no_cycle(self):
+        self.assertEqual(self.check.main(['-l', self.log.name]),
+                         self.check.UNKNOWN)
+        self.assertEqual(self.check.main(['-l', '/nonexistent']),
+                         self.check.UNKNOWN)
+
+
+class TestCheckQueueDepth(unittest.TestCase):
+
+    def setUp(self):
+        self.check = load_check('check_aodh_queue_depth')
+        url_file = tempfile.NamedTemporaryFile('w', delete=False)
+        self.addCleanup(os.remove, url_file.name)
+        url_file.write('rabbit://aodh:pw@10.0.0.1:5672,'
+                       'aodh:pw@10.0.0.2:5672/openstack\n')
+        url_file.close()
+        self.url_file = url_file.name
+        self.kombu = mock.MagicMock()
+        patcher = mock.patch.dict('sys.modules', kombu=self.kombu)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        connection = self.kombu.Connection.return_value.__enter__
+        self.channel = connection.return_value.channel.return_value
+
+    def test_broker_urls(self):
+        self.assertEqual(
+            self.check.broker_urls('rabbit://u:p@h1:5672,u:p@h2:5672/os'),
+            'amqp://u:p@h1:5672/os;amqp://u:p@h2:5672/os')
+        self.assertRaises(ValueError, self.check.broker_urls, 'kafka://h1')
+
+    def test_depth(self):
+        self.channel.queue_declare.return_value = ('alarming.sample', 5, 2)
+        self.assertEqual(self.check.main(['-f', self.url_file]),
+                         self.check.OK)
+        self.kombu.Connection.assert_called_once_with(
+            'amqp://aodh:pw@10.0.0.1:5672/openstack;'
+            'amqp://aodh:pw@10.0.0.2:5672/openstack', connect_timeout=5)
+        self.channel.queue_declare.assert_called_once_with(
+            queue='alarming.sample', passive=True)
+        self.channel.queue_declare.return_value = ('alarming.sample', 500, 2)
+        self.assertEqual(self.check.main(['-f', self.url_file]),
+                         self.check.WARNING)
+        self.channel.queue_declare.return_value = ('alarming.sample', 5000, 2)
+        self.assertEqual(self.check.main(['-f', self.url_file]),
+                         self.check.CRITICAL)
+
+    def test_broker_error(self):
+        self.channel.queue_declare.side_effect = OSError('refused')
+        self.assertEqual(self.check.main(['-f', self.url_file]),
+                         self.check.UNKNOWN)
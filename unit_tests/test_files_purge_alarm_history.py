@@ -0,0 +1,71 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib.machinery
+import importlib.util
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(__file__),
+                      '..', 'src', 'files', 'aodh-purge-alarm-history')
+
+
+def load_script():
+    """Import the extensionless purge script, with SQLAlchemy mocked out."""
+    loader = importlib.machinery.SourceFileLoader('purge', SCRIPT)
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader('purge', loader))
+    with mock.patch.dict(sys.modules, {'sqlalchemy': mock.MagicMock()}):
+        loader.exec_module(module)
+    return module
+
+
+class TestPurgeAlarmHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.purge = load_script()
+        self.connection = mock.MagicMock()
+
+    def test_delete_batch(self):
+        self.connection.execute.return_value = [('a',), ('b',)]
+        self.assertEqual(
+            self.purge.delete_batch(self.connection, '2020-01-01', 2), 2)
+        self.connection.begin.assert_called_once_with()
+        self.assertEqual(self.connection.execute.call_args_list[0][0][1],
+                         {'before': '2020-01-01', 'limit': 2})
+        self.purge.sqlalchemy.text.assert_called_with(
+            'DELETE FROM alarm_history WHERE event_id IN (:id0, :id1)')
+        self.assertEqual(self.connection.execute.call_args_list[1][0][1],
+                         {'id0': 'a', 'id1': 'b'})
+
+    def test_delete_batch_nothing_left(self):
+        self.connection.execute.return_value = []
+        self.assertEqual(
+            self.purge.delete_batch(self.connection, '2020-01-01', 2), 0)
+        self.connection.execute.assert_called_once()
+
+    def test_purge(self):
+        out = io.StringIO()
+        with mock.patch.object(self.purge, 'delete_batch',
+                               side_effect=[2, 2, 1]) as delete_batch, \
+                mock.patch.object(self.purge.time, 'sleep') as sleep:
+            self.purge.purge(self.connection, '2020-01-01', 2, 0.5, out)
+        self.assertEqual(delete_batch.call_count, 3)
+        self.assertEqual(sleep.call_args_list, [mock.call(0.5)] * 2)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['{"deleted": 2}', '{"deleted": 2}',
+                          '{"deleted": 1}'])
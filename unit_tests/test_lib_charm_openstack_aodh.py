@@ -12,6 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
+import shutil
+import tempfile
 from unittest import mock
 
 import charm.openstack.aodh as aodh
@@ -56,6 +60,18 @@ class TestOpenStackAodh(Helper):
         keystone.register_endpoints.assert_called_once_with(
             'type1', 'region1', 'public_url', 'internal_url', 'admin_url')
 
+    def test_assess_status(self):
+        self.patch_object(aodh.hookenv, 'atexit')
+        self.patch_object(aodh, '_status_deferred', new=False)
+        self.patch_object(aodh.AodhCharm.singleton, 'assess_status')
+        aodh.assess_status()
+        aodh.assess_status()
+        self.atexit.assert_called_once_with(aodh.assess_status_now)
+        self.assess_status.assert_not_called()
+        aodh.assess_status_now()
+        self.assess_status.assert_called_once_with()
+        self.assertFalse(aodh._status_deferred)
+
     def test_render_configs(self):
         self.patch_object(aodh.AodhCharm.singleton, 'render_with_interfaces')
         aodh.render_configs('interfaces-list')
@@ -99,6 +115,303 @@ class TestAodhAdapters(Helper):
                 aodh.charms_openstack.adapters.APIConfigurationAdapter))
 
 
+class TestIniSections(Helper):
+
+    def test_ini_sections(self):
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('[DEFAULT]\ndebug = False\n\n'
+                    '[api]\nworkers = 4\n')
+            f.flush()
+            self.assertEqual(aodh.ini_sections(f.name), {
+                'DEFAULT': {'debug': 'False'},
+                'api': {'workers': '4'},
+            })
+
+    def test_ini_sections_missing(self):
+        self.assertIsNone(aodh.ini_sections('/nonexistent/aodh.conf'))
+
+
+HAPROXY_CFG = """\
+defaults
+    mode tcp
+    timeout client 90000
+    timeout server 90000
+
+listen stats
+    mode http
+
+frontend tcp-in_aodh-api
+    bind *:8042
+    default_backend aodh-api_10.0.0.10
+
+backend aodh-api_10.0.0.10
+    balance leastconn
+    server aodh-0 10.0.0.10:8032 check
+    server aodh-1 10.0.0.11:8032 check
+"""
+
+
+class TestAodhConfigProperties(Helper):
+
+    def test_daemon_workers(self):
+        self.patch_object(aodh.reactive, 'is_flag_set', return_value=False)
+        cfg = mock.MagicMock(workers=8,
+                             coordination_backend_url=None,
+                             evaluator_workers=None,
+                             notifier_workers=None,
+                             listener_workers=2)
+        self.assertEqual(aodh.daemon_workers(cfg),
+                         {'evaluator': 1, 'notifier': 8, 'listener': 2})
+        self.is_flag_set.return_value = True
+        self.assertEqual(aodh.daemon_workers(cfg)['evaluator'], 8)
+        self.is_flag_set.return_value = False
+        cfg.evaluator_workers = 4
+        self.assertEqual(aodh.daemon_workers(cfg)['evaluator'], 4)
+
+    def test_api_memory_sizing(self):
+        self.patch_object(aodh.unitdata, 'kv')
+        self.patch_object(aodh, 'daemon_workers',
+                          return_value={'evaluator': 1,
+                                        'notifier': 2,
+                                        'listener': 2})
+        self.kv.return_value.get.return_value = None
+        cfg = mock.MagicMock(memory_budget=2048,
+                             wsgi_worker_context={'processes': 8})
+        self.assertEqual(aodh.api_memory_sizing(cfg), {
+            'processes': 8, 'cpu_processes': 8, 'headroom': None})
+        self.kv.return_value.get.assert_called_once_with(aodh.WORKER_RSS_KEY)
+        # notifier and listener are estimated at the API's size
+        self.kv.return_value.get.return_value = {'api': 200,
+                                                 'evaluator': 100}
+        self.assertEqual(aodh.api_memory_sizing(cfg), {
+            'processes': 3, 'cpu_processes': 8, 'headroom': 48})
+        cfg.memory_budget = 8192
+        self.assertEqual(aodh.api_memory_sizing(cfg), {
+            'processes': 8, 'cpu_processes': 8, 'headroom': 5192})
+        cfg.memory_budget = 1024
+        self.assertEqual(aodh.api_memory_sizing(cfg), {
+            'processes': 1, 'cpu_processes': 8, 'headroom': -576})
+        cfg.memory_budget = None
+        self.assertEqual(aodh.api_memory_sizing(cfg)['headroom'], None)
+
+    def test_wsgi_tuning(self):
+        cfg = mock.MagicMock(wsgi_threads=None,
+                             wsgi_listen_backlog=None,
+                             wsgi_queue_timeout=30,
+                             wsgi_request_timeout=120,
+                             wsgi_inactivity_timeout=0,
+                             wsgi_worker_context={'processes': 4})
+        self.assertEqual(aodh.wsgi_tuning(cfg), {
+            'threads': 10,
+            'listen_backlog': 160,
+            'queue_timeout': 30,
+            'request_timeout': 120,
+            'inactivity_timeout': 0,
+        })
+        cfg.wsgi_threads = 2
+        cfg.wsgi_worker_context = {'processes': 1}
+        self.assertEqual(aodh.wsgi_tuning(cfg)['listen_backlog'], 100)
+        cfg.wsgi_listen_backlog = 500
+        self.assertEqual(aodh.wsgi_tuning(cfg)['listen_backlog'], 500)
+
+    def test_database_pool(self):
+        self.patch_object(aodh, 'daemon_workers',
+                          return_value={'evaluator': 1,
+                                        'notifier': 4,
+                                        'listener': 4})
+        self.patch_object(aodh, 'wsgi_tuning',
+                          return_value={'threads': 10})
+        cfg = mock.MagicMock(workers=4,
+                             database_connections_per_unit=None,
+                             database_max_pool_size=None,
+                             database_max_overflow=None,
+                             database_pool_timeout=10,
+                             database_connection_recycle_time=None)
+        self.assertEqual(aodh.database_pool(cfg), {
+            'max_pool_size': 10,
+            'max_overflow': 0,
+            'pool_timeout': 10,
+            'connection_recycle_time': None,
+        })
+        cfg.database_connections_per_unit = 130
+        pool = aodh.database_pool(cfg)
+        self.assertEqual((pool['max_pool_size'], pool['max_overflow']),
+                         (5, 5))
+        cfg.database_max_overflow = 0
+        self.assertEqual(aodh.database_pool(cfg)['max_overflow'], 0)
+
+    def test_per_daemon_values(self):
+        self.assertEqual(aodh.per_daemon_values(None), {})
+        self.assertEqual(aodh.per_daemon_values('0-3'),
+                         {'evaluator': '0-3',
+                          'notifier': '0-3',
+                          'listener': '0-3'})
+        self.assertEqual(aodh.per_daemon_values('evaluator:4,5 0-3'),
+                         {'evaluator': '4,5',
+                          'notifier': '0-3',
+                          'listener': '0-3'})
+        self.assertEqual(aodh.per_daemon_values('notifier:2G'),
+                         {'notifier': '2G'})
+        with self.assertRaises(ValueError):
+            aodh.per_daemon_values('api:0-3')
+
+    def test_systemd_resources(self):
+        cfg = mock.MagicMock(daemon_cpu_affinity='0-3 evaluator:4,5',
+                             daemon_cpu_quota=None,
+                             daemon_memory_max='listener:1G',
+                             daemon_nice='evaluator:-5',
+                             daemon_io_weight='evaluater:500')
+        resources = aodh.systemd_resources(cfg)
+        self.assertEqual(resources['evaluator'],
+                         {'CPUAffinity': '4,5', 'Nice': '-5'})
+        self.assertEqual(list(resources['evaluator']),
+                         ['CPUAffinity', 'Nice'])
+        self.assertEqual(resources['notifier'], {'CPUAffinity': '0-3'})
+        self.assertEqual(resources['listener'],
+                         {'CPUAffinity': '0-3', 'MemoryMax': '1G'})
+
+    def test_haproxy_api(self):
+        cfg = mock.MagicMock(haproxy_balance='',
+                             haproxy_server_maxconn=None,
+                             haproxy_api_queue_timeout=None,
+                             haproxy_api_client_timeout=None,
+                             haproxy_api_server_timeout=None,
+                             haproxy_http_keep_alive_timeout=None)
+        self.assertEqual(aodh.haproxy_api(cfg), {
+            'balance': None,
+            'server_maxconn': None,
+            'queue_timeout': None,
+            'client_timeout': None,
+            'server_timeout': None,
+            'keep_alive_timeout': None,
+        })
+        cfg.haproxy_balance = 'roundrobin'
+        cfg.haproxy_api_server_timeout = 300000
+        haproxy = aodh.haproxy_api(cfg)
+        self.assertEqual(haproxy['balance'], 'roundrobin')
+        self.assertEqual(haproxy['server_timeout'], 300000)
+
+    def test_tune_haproxy_cfg(self):
+        settings = {
+            'balance': None,
+            'server_maxconn': None,
+            'queue_timeout': None,
+            'client_timeout': None,
+            'server_timeout': None,
+            'keep_alive_timeout': None,
+        }
+        self.assertEqual(aodh.tune_haproxy_cfg(HAPROXY_CFG, settings),
+                         HAPROXY_CFG)
+        settings.update(balance='roundrobin', server_maxconn=16,
+                        server_timeout=300000, client_timeout=120000)
+        self.assertEqual(aodh.tune_haproxy_cfg(HAPROXY_CFG, settings), (
+            'defaults\n'
+            '    mode tcp\n'
+            '    timeout client 90000\n'
+            '    timeout server 90000\n'
+            '\n'
+            'listen stats\n'
+            '    mode http\n'
+            '\n'
+            'frontend tcp-in_aodh-api\n'
+            '    bind *:8042\n'
+            '    default_backend aodh-api_10.0.0.10\n'
+            '    timeout client 120000\n'
+            '\n'
+            'backend aodh-api_10.0.0.10\n'
+            '    balance leastconn\n'
+            '    server aodh-0 10.0.0.10:8032 check maxconn 16\n'
+            '    server aodh-1 10.0.0.11:8032 check maxconn 16\n'
+            '    balance roundrobin\n'
+            '    timeout server 300000\n'))
+        settings = dict.fromkeys(settings)
+        settings['keep_alive_timeout'] = 5000
+        tuned = aodh.tune_haproxy_cfg(HAPROXY_CFG, settings).splitlines()
+        frontend = tuned[tuned.index('frontend tcp-in_aodh-api'):]
+        self.assertEqual(frontend[3:7], [
+            '    mode http',
+            '    option httplog',
+            '    option http-keep-alive',
+            '    timeout http-keep-alive 5000'])
+        self.assertEqual(tuned[-2:], [
+            '    mode http',
+            '    option http-keep-alive'])
+
+    def test_messaging_tuning(self):
+        cfg = mock.MagicMock(notifier_batch_size=20,
+                             listener_batch_size=50,
+                             rabbit_qos_prefetch_count=None,
+                             executor_thread_pool_size=None,
+                             rabbit_heartbeat_timeout_threshold=None,
+                             rabbit_heartbeat_rate=None)
+        self.assertEqual(aodh.messaging_tuning(cfg), {
+            'rabbit_qos_prefetch_count': 100,
+            'executor_thread_pool_size': 100,
+            'heartbeat_timeout_threshold': None,
+            'heartbeat_rate': None,
+        })
+        cfg.rabbit_qos_prefetch_count = 0
+        cfg.rabbit_heartbeat_timeout_threshold = 30
+        tuning = aodh.messaging_tuning(cfg)
+        self.assertEqual(tuning['rabbit_qos_prefetch_count'], 0)
+        self.assertIsNone(tuning['executor_thread_pool_size'])
+        self.assertEqual(tuning['heartbeat_timeout_threshold'], 30)
+        cfg.executor_thread_pool_size = 16
+        self.assertEqual(
+            aodh.messaging_tuning(cfg)['executor_thread_pool_size'], 16)
+
+
+class TestReplacePort(Helper):
+
+    def test_replace_port(self):
+        self.assertEqual(
+            aodh.replace_port(
+                'mysql+pymysql://aodh:pw@127.0.0.1/aodh?charset=utf8', 3307),
+            'mysql+pymysql://aodh:pw@127.0.0.1:3307/aodh?charset=utf8')
+        self.assertEqual(
+            aodh.replace_port('mysql://aodh:pw@[2001:db8::1]:3306/aodh',
+                              3307),
+            'mysql://aodh:pw@[2001:db8::1]:3307/aodh')
+
+
+class TestSharedDBRelationAdapter(Helper):
+
+    def test_read_only_uri(self):
+        self.patch_object(aodh.charms_openstack.adapters.
+                          DatabaseRelationAdapter, 'uri',
+                          new_callable=mock.PropertyMock,
+                          return_value='mysql://aodh:pw@127.0.0.1/aodh')
+        self.patch_object(aodh.hookenv, 'config', return_value=None)
+        adapter = aodh.SharedDBRelationAdapter(mock.MagicMock())
+        self.assertIsNone(adapter.read_only_uri)
+        self.config.return_value = 3307
+        self.assertEqual(adapter.read_only_uri,
+                         'mysql://aodh:pw@127.0.0.1:3307/aodh')
+        self.config.assert_called_with('database-read-only-port')
+
+
+class TestMemcacheRelationAdapter(Helper):
+
+    def test_servers(self):
+        self.patch_object(aodh.ch_ip, 'format_ipv6_addr',
+                          side_effect=lambda a: '[{}]'.format(a)
+                          if ':' in a else None)
+        relation = mock.MagicMock()
+        relation.memcache_hosts.return_value = ['10.0.0.2', 'fd00::1']
+        adapter = aodh.MemcacheRelationAdapter(relation)
+        self.assertEqual(adapter.servers,
+                         '10.0.0.2:11211,[fd00::1]:11211')
+
+    def test_url(self):
+        relation = mock.MagicMock()
+        relation.memcache_hosts.return_value = ['10.0.0.2', '10.0.0.1']
+        adapter = aodh.MemcacheRelationAdapter(relation)
+        self.assertEqual(adapter.url,
+                         'memcached://10.0.0.1:11211?timeout=5')
+        relation.memcache_hosts.return_value = []
+        self.assertIsNone(adapter.url)
+
+
 class TestAodhCharm(Helper):
 
     def test_install(self):
@@ -125,10 +438,25 @@ class TestAodhCharm(Helper):
         self.check_call.assert_called_once_with(['systemctl', 'daemon-reload'])
         self.service_restart.assert_called_once_with('aodh-api')
 
+    def test_daemon_resources_restart_map(self):
+        for charm_class in (aodh.AodhCharm, aodh.AodhCharmOcata):
+            self.assertEqual(
+                charm_class.restart_map[
+                    '/etc/systemd/system/aodh-listener.service.d/'
+                    'aodh-listener-resources.conf'],
+                ['aodh-listener'])
+
     def test_render_nrpe(self):
         """Test NRPE renders correctly pre Ocata."""
         self.patch_object(aodh.nrpe, 'NRPE')
         self.patch_object(aodh.nrpe, 'add_init_service_checks')
+        self.patch_object(aodh.nrpe, 'copy_nrpe_checks')
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.reactive, 'endpoint_from_flag',
+                          return_value=None)
+        self.patch_object(aodh.AodhCharm, 'write_nagios_transport_url',
+                          return_value=False)
+        self.patch_object(aodh.AodhCharm, 'grant_log_access')
         services = ['aodh-api',
                     'aodh-evaluator',
                     'aodh-notifier',
@@ -148,9 +476,938 @@ class TestAodhCharm(Helper):
             mock.call().write(),
         ])
 
+    def test_render_with_interfaces(self):
+        self.patch_object(aodh.charms_openstack.charm.OpenStackCharm,
+                          'render_with_interfaces')
+        self.patch_object(aodh.AodhCharm, 'render_fingerprint',
+                          side_effect=['old', 'new'])
+        self.patch_object(aodh.hookenv, 'hook_name',
+                          return_value='config-changed')
+        self.patch_object(aodh.unitdata, 'kv')
+        kv = self.kv.return_value
+        kv.get.return_value = 'stored'
+        target = aodh.AodhCharm()
+        target.config = {}
+        target.render_with_interfaces(['interfaces'])
+        self.render_with_interfaces.assert_called_once_with(
+            ['interfaces'], None)
+        kv.set.assert_called_once_with(aodh.RENDER_FINGERPRINT_KEY, 'new')
+        self.render_fingerprint.assert_called_with(['interfaces'])
+        # the high-water mark of the workers starts over with the render
+        kv.unset.assert_has_calls([mock.call(aodh.WORKER_RSS_PEAK_KEY),
+                                   mock.call(aodh.API_SIZING_KEY)])
+
+    def test_render_with_interfaces_memory_budget(self):
+        self.patch_object(aodh.charms_openstack.charm.OpenStackCharm,
+                          'render_with_interfaces')
+        self.patch_object(aodh.AodhCharm, 'render_fingerprint',
+                          side_effect=['old', 'new'])
+        self.patch_object(aodh.AodhCharm, 'adapters_class')
+        self.patch_object(aodh.hookenv, 'hook_name',
+                          return_value='config-changed')
+        self.patch_object(aodh.unitdata, 'kv')
+        kv = self.kv.return_value
+        kv.get.return_value = 'stored'
+        sizing = {'processes': 3, 'cpu_processes': 8, 'headroom': 120}
+        self.adapters_class.return_value.options.api_memory_sizing = sizing
+        target = aodh.AodhCharm()
+        target.config = {'memory-budget': 2048}
+        target.render_with_interfaces(['interfaces'])
+        self.adapters_class.assert_called_once_with(['interfaces'],
+                                                    charm_instance=target)
+        kv.set.assert_called_with(aodh.API_SIZING_KEY, sizing)
+
+    def test_render_with_interfaces_unchanged(self):
+        self.patch_object(aodh.charms_openstack.charm.OpenStackCharm,
+                          'render_with_interfaces')
+        self.patch_object(aodh.AodhCharm, 'render_fingerprint',
+                          return_value='stored')
+        self.patch_object(aodh.hookenv, 'hook_name',
+                          return_value='update-status')
+        self.patch_object(aodh.unitdata, 'kv')
+        kv = self.kv.return_value
+        kv.get.return_value = 'stored'
+        target = aodh.AodhCharm()
+        target.render_with_interfaces(['interfaces'])
+        self.render_with_interfaces.assert_not_called()
+        kv.set.assert_not_called()
+        # templates may change with the charm so upgrades always render
+        self.hook_name.return_value = 'upgrade-charm'
+        target.render_with_interfaces(['interfaces'])
+        self.render_with_interfaces.assert_called_once_with(
+            ['interfaces'], None)
+
+    def test_interface_relation_data(self):
+        unit = mock.MagicMock(unit_name='rabbitmq-server/0',
+                              received_raw={'password': 'pw'})
+        relation = mock.MagicMock(relation_id='amqp:1', joined_units=[unit])
+        endpoint = mock.MagicMock(spec=['relations'], relations=[relation])
+        conversation = mock.MagicMock(relation_ids=['shared-db:2'])
+        relation_base = mock.MagicMock(spec=['conversations'])
+        relation_base.conversations.return_value = [conversation]
+        self.patch_object(aodh.hookenv, 'related_units',
+                          return_value=['mysql/0'])
+        self.patch_object(aodh.hookenv, 'relation_get',
+                          return_value={'db_host': '10.0.0.1'})
+        self.assertEqual(
+            aodh.interface_relation_data([endpoint, relation_base, None]),
+            {'amqp:1': {'rabbitmq-server/0': {'password': 'pw'}},
+             'shared-db:2': {'mysql/0': {'db_host': '10.0.0.1'}}})
+        self.related_units.assert_called_once_with('shared-db:2')
+        self.relation_get.assert_called_once_with(rid='shared-db:2',
+                                                  unit='mysql/0')
+
+    def test_render_fingerprint(self):
+        self.patch_object(aodh, 'interface_relation_data',
+                          return_value={'amqp:1': {}})
+        self.patch_object(aodh.unitdata, 'kv')
+        self.kv.return_value.get.return_value = {'api': 150}
+        self.patch_object(aodh.ch_host, 'path_hash', return_value='hash')
+        self.patch_object(aodh.AodhCharm, 'full_restart_map',
+                          new_callable=mock.PropertyMock,
+                          return_value={aodh.AODH_CONF: []})
+        target = aodh.AodhCharm()
+        target.config = {'debug': False}
+        fingerprint = target.render_fingerprint(['interfaces'])
+        self.assertEqual(fingerprint,
+                         target.render_fingerprint(['interfaces']))
+        self.interface_relation_data.assert_called_with(['interfaces'])
+        target.config = {'debug': True}
+        self.assertNotEqual(fingerprint,
+                            target.render_fingerprint(['interfaces']))
+        fingerprint = target.render_fingerprint(['interfaces'])
+        self.kv.return_value.get.return_value = {'api': 300}
+        self.assertNotEqual(fingerprint,
+                            target.render_fingerprint(['interfaces']))
+        fingerprint = target.render_fingerprint(['interfaces'])
+        self.interface_relation_data.return_value = {'amqp:1': {'u/0': {}}}
+        self.assertNotEqual(fingerprint,
+                            target.render_fingerprint(['interfaces']))
+
+    def test_package_db_revision(self):
+        versions = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, versions)
+        for name, content in (
+                ('1_initial.py', "revision = '1'\ndown_revision = None\n"),
+                ('2_index.py', 'revision = "2"\ndown_revision = "1"\n'),
+                ('3_column.py', "revision = '3'\ndown_revision = ('2',)\n"),
+                ('README', "revision = '4'\n")):
+            with open(os.path.join(versions, name), 'w') as f:
+                f.write(content)
+        self.patch_object(aodh, 'AODH_ALEMBIC_VERSIONS', new=versions)
+        self.assertEqual(aodh.AodhCharm.package_db_revision(), '3')
+        self.patch_object(aodh, 'AODH_ALEMBIC_VERSIONS', new='/nonexistent')
+        self.assertIsNone(aodh.AodhCharm.package_db_revision())
+
+    def test_db_sync_done(self):
+        self.patch_object(aodh.AodhCharm, 'package_db_revision',
+                          return_value='3')
+        self.patch_object(aodh.hookenv, 'leader_get', return_value='2')
+        target = aodh.AodhCharm()
+        self.assertFalse(target.db_sync_done())
+        self.leader_get.assert_called_once_with('db-sync-revision')
+        self.leader_get.return_value = '3'
+        self.assertTrue(target.db_sync_done())
+        self.package_db_revision.return_value = None
+        self.leader_get.return_value = True
+        self.assertTrue(target.db_sync_done())
+        self.leader_get.assert_called_with('db-sync-done')
+
+    def test_db_sync(self):
+        self.patch_object(aodh.AodhCharm, 'db_sync_done', return_value=False)
+        self.patch_object(aodh.AodhCharm, 'package_db_revision',
+                          return_value='3')
+        self.patch_object(aodh.AodhCharm, 'database_revision',
+                          return_value='2')
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=True)
+        self.patch_object(aodh.hookenv, 'leader_set')
+        self.patch('subprocess.check_call', name='check_call')
+        target = aodh.AodhCharm()
+        self.assertTrue(target.db_sync())
+        self.check_call.assert_called_once_with(['aodh-dbsync'])
+        self.leader_set.assert_called_once_with(
+            {'db-sync-done': True, 'db-sync-revision': '3'})
+
+    def test_db_sync_at_head(self):
+        self.patch_object(aodh.AodhCharm, 'db_sync_done', return_value=False)
+        self.patch_object(aodh.AodhCharm, 'package_db_revision',
+                          return_value='3')
+        self.patch_object(aodh.AodhCharm, 'database_revision',
+                          return_value='3')
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=True)
+        self.patch_object(aodh.hookenv, 'leader_set')
+        self.patch('subprocess.check_call', name='check_call')
+        target = aodh.AodhCharm()
+        self.assertFalse(target.db_sync())
+        self.check_call.assert_not_called()
+        self.leader_set.assert_called_once_with(
+            {'db-sync-done': True, 'db-sync-revision': '3'})
+
+    def test_db_sync_follower(self):
+        self.patch_object(aodh.AodhCharm, 'db_sync_done', return_value=False)
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=False)
+        self.patch_object(aodh.hookenv, 'leader_set')
+        self.patch('subprocess.check_call', name='check_call')
+        target = aodh.AodhCharm()
+        self.assertFalse(target.db_sync())
+        self.check_call.assert_not_called()
+        self.leader_set.assert_not_called()
+
+    def test_database_revision(self):
+        self.patch('subprocess.check_output', name='check_output',
+                   return_value='12fe8fac9fe4\n')
+        self.assertEqual(aodh.AodhCharm.database_revision(), '12fe8fac9fe4')
+        self.check_output.side_effect = aodh.subprocess.CalledProcessError(
+            1, 'python3')
+        self.assertIsNone(aodh.AodhCharm.database_revision())
+
+    def test_partition_members(self):
+        self.patch_object(aodh.os.path, 'isdir', return_value=True)
+        self.patch('subprocess.check_output', name='check_output',
+                   return_value='4\n')
+        self.assertEqual(aodh.AodhCharm.partition_members(), 4)
+        self.assertEqual(self.check_output.call_args[0][0],
+                         ['python3', '-c', aodh.PARTITION_MEMBERS_SCRIPT])
+        self.check_output.side_effect = aodh.subprocess.CalledProcessError(
+            1, 'python3')
+        self.assertIsNone(aodh.AodhCharm.partition_members())
+        self.isdir.return_value = False
+        self.check_output.reset_mock()
+        self.assertIsNone(aodh.AodhCharm.partition_members())
+        self.check_output.assert_not_called()
+
+    def test_cluster_size(self):
+        self.patch_object(aodh.hookenv, 'relation_ids',
+                          return_value=['cluster:1'])
+        self.patch_object(aodh.hookenv, 'related_units',
+                          return_value=['aodh/1', 'aodh/2'])
+        target = aodh.AodhCharm()
+        self.assertEqual(target.cluster_size(), 3)
+        self.relation_ids.assert_called_once_with('cluster')
+
+    def test_custom_assess_status_check(self):
+        self.patch_object(aodh.hookenv, 'relation_ids', return_value=[])
+        self.patch_object(aodh.reactive, 'is_flag_set', return_value=False)
+        target = aodh.AodhCharm()
+        target.config = {}
+        self.assertEqual(target.custom_assess_status_check(), (None, None))
+        self.relation_ids.side_effect = lambda relation: (
+            ['notification-amqp:3'] if relation == 'notification-amqp'
+            else [])
+        self.assertEqual(target.custom_assess_status_check(),
+                         ('waiting', "'notification-amqp' incomplete"))
+        self.is_flag_set.assert_called_once_with(
+            'notification-amqp.available')
+        self.relation_ids.side_effect = None
+        self.relation_ids.return_value = ['rid:1']
+        self.assertEqual(
+            target.custom_assess_status_check(),
+            ('waiting',
+             "'notification-amqp', 'shared-db-read-only' incomplete"))
+        self.is_flag_set.return_value = True
+        self.assertEqual(target.custom_assess_status_check(), (None, None))
+        target.config = {'daemon-nice': 'evaluator:-5 api:5'}
+        self.assertEqual(
+            target.custom_assess_status_check(),
+            ('blocked', "invalid daemon-nice: unknown daemon 'api'"))
+        target.config = {'haproxy-balance': 'fastest'}
+        self.assertEqual(target.custom_assess_status_check(),
+                         ('blocked', "invalid haproxy-balance 'fastest'"))
+
+    def test_render_configs_haproxy(self):
+        self.patch_object(aodh.AodhCharm, 'restart_on_change')
+        self.patch_object(aodh.ch_templating, 'render',
+                          return_value=HAPROXY_CFG)
+        self.patch_object(aodh.ch_os_templating, 'get_loader')
+        self.patch_object(aodh.ch_host, 'write_file')
+        self.patch_object(aodh, 'tune_haproxy_cfg', return_value='tuned\n')
+        self.patch_object(aodh.charms_openstack.charm.HAOpenStackCharm,
+                          'render_configs', name='super_render_configs')
+        adapters = mock.MagicMock()
+        target = aodh.AodhCharm()
+        target.render_configs([aodh.AODH_CONF, target.HAPROXY_CONF],
+                              adapters_instance=adapters)
+        self.restart_on_change.assert_called_once_with()
+        self.render.assert_called_once_with(
+            source='haproxy.cfg', target=None, context=adapters,
+            template_loader=self.get_loader.return_value)
+        self.tune_haproxy_cfg.assert_called_once_with(
+            HAPROXY_CFG, adapters.options.haproxy_api)
+        self.write_file.assert_called_once_with(
+            target.HAPROXY_CONF, b'tuned\n', group='aodh', perms=0o440)
+        self.super_render_configs.assert_called_once_with(
+            [aodh.AODH_CONF], adapters)
+        self.render.reset_mock()
+        target.render_configs([aodh.AODH_CONF])
+        self.render.assert_not_called()
+
+    def test_custom_assess_status_last_check(self):
+        self.patch_object(aodh.reactive, 'is_flag_set', return_value=False)
+        self.patch_object(aodh.AodhCharm, 'partition_members',
+                          return_value=3)
+        self.patch_object(aodh.unitdata, 'kv')
+        self.kv.return_value.get.return_value = None
+        target = aodh.AodhCharm()
+        target.config = {}
+        self.assertEqual(target.custom_assess_status_last_check(),
+                         (None, None))
+        self.is_flag_set.return_value = True
+        self.assertEqual(target.custom_assess_status_last_check(),
+                         ('active', 'Unit is ready (partition members: 3)'))
+        self.partition_members.return_value = None
+        self.assertEqual(target.custom_assess_status_last_check(),
+                         (None, None))
+        self.is_flag_set.return_value = False
+        self.kv.return_value.get.return_value = {
+            'processes': 3, 'cpu_processes': 8, 'headroom': 120}
+        self.assertEqual(
+            target.custom_assess_status_last_check(),
+            ('active',
+             'Unit is ready (api processes: 3/8, headroom: 120MiB)'))
+        self.kv.return_value.get.assert_called_with(aodh.API_SIZING_KEY)
+
+    def test_benchmark_evaluator(self):
+        self.patch_object(aodh.os.path, 'isdir', return_value=False)
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch('subprocess.check_output', name='check_output',
+                   return_value='{"evaluation-rate": 120.5}\n')
+        with self.assertRaises(RuntimeError):
+            aodh.AodhCharm.benchmark_evaluator(200, 3)
+        self.check_output.assert_not_called()
+        self.isdir.return_value = True
+        self.assertEqual(aodh.AodhCharm.benchmark_evaluator(200, 3),
+                         {'evaluation-rate': 120.5})
+        self.check_output.assert_called_once_with(
+            ['python3', '/charm/files/aodh-benchmark-evaluator',
+             '--config-file', aodh.AODH_CONF,
+             '--alarms', '200', '--cycles', '3'],
+            universal_newlines=True)
+
+    def patch_purge(self, leader_settings, progress=None):
+        self.patch_object(aodh.unitdata, 'kv')
+        self.kv.return_value.get.return_value = progress
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=True)
+        self.patch_object(aodh.hookenv, 'leader_get',
+                          side_effect=leader_settings.get)
+        self.patch_object(aodh.hookenv, 'leader_set',
+                          side_effect=leader_settings.update)
+        self.patch_object(aodh.hookenv, 'action_log')
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.os.path, 'isdir', return_value=True)
+        self.patch('subprocess.Popen', name='Popen')
+        self.Popen.return_value.stdout = [
+            '{"deleted": 1000}\n', '{"deleted": 500}\n']
+        self.Popen.return_value.wait.return_value = 0
+
+    def test_purge_alarm_history(self):
+        leader_settings = {}
+        self.patch_purge(leader_settings)
+        target = aodh.AodhCharm()
+        target.config = {'alarm-history-delete-batch-size': 0}
+        result = target.purge_alarm_history(older_than=0, interval=0.5)
+        self.assertEqual(result['deleted'], 1500)
+        self.Popen.assert_called_once_with(
+            ['python3', '/charm/files/aodh-purge-alarm-history',
+             '--config-file', aodh.AODH_CONF,
+             '--before', result['before'],
+             '--batch-size', '1000',
+             '--interval', '0.5'],
+            stdout=aodh.subprocess.PIPE, universal_newlines=True)
+        self.action_log.assert_called_with(
+            'Deleted 1500 records older than {}'.format(result['before']))
+        self.assertEqual(self.action_log.call_count, 2)
+        # progress is kept locally, leader settings only change at the start
+        # and the end
+        self.kv.return_value.set.assert_called_with(
+            aodh.PURGE_PROGRESS_KEY,
+            {'before': result['before'], 'deleted': 1500})
+        self.assertEqual(self.kv.return_value.flush.call_count, 3)
+        self.assertEqual(self.leader_set.call_count, 2)
+        # the checkpoint is cleared once the purge completes
+        self.assertEqual(leader_settings,
+                         {aodh.PURGE_CHECKPOINT_KEY: None})
+        self.kv.return_value.unset.assert_called_once_with(
+            aodh.PURGE_PROGRESS_KEY)
+
+    def test_purge_alarm_history_resume(self):
+        leader_settings = {aodh.PURGE_CHECKPOINT_KEY: json.dumps(
+            {'before': '2026-09-18 00:00:00', 'deleted': 200})}
+        # stale progress of an earlier purge is ignored
+        self.patch_purge(leader_settings, progress={
+            'before': '2026-08-18 00:00:00', 'deleted': 9000})
+        self.Popen.return_value.wait.return_value = 1
+        target = aodh.AodhCharm()
+        target.config = {}
+        with self.assertRaises(RuntimeError):
+            target.purge_alarm_history(batch_size=100)
+        self.action_log.assert_any_call(
+            'Resuming the purge of records before 2026-09-18 00:00:00, '
+            '200 deleted so far')
+        self.assertIn('2026-09-18 00:00:00', self.Popen.call_args[0][0])
+        self.assertEqual(
+            json.loads(leader_settings[aodh.PURGE_CHECKPOINT_KEY]),
+            {'before': '2026-09-18 00:00:00', 'deleted': 1700})
+        # progress made locally is more recent than leader settings
+        self.kv.return_value.get.return_value = {
+            'before': '2026-09-18 00:00:00', 'deleted': 2700}
+        with self.assertRaises(RuntimeError):
+            target.purge_alarm_history()
+        self.action_log.assert_any_call(
+            'Resuming the purge of records before 2026-09-18 00:00:00, '
+            '2700 deleted so far')
+        # nothing to resume once the purge completed
+        leader_settings[aodh.PURGE_CHECKPOINT_KEY] = None
+        with self.assertRaises(RuntimeError):
+            target.purge_alarm_history()
+
+    def test_purge_alarm_history_leadership(self):
+        self.patch_purge({})
+        self.is_leader.side_effect = [True, False]
+        target = aodh.AodhCharm()
+        target.config = {}
+        with self.assertRaises(RuntimeError):
+            target.purge_alarm_history(older_than=30)
+        self.Popen.return_value.terminate.assert_called_once_with()
+        self.is_leader.side_effect = None
+        self.is_leader.return_value = False
+        self.Popen.reset_mock()
+        with self.assertRaises(RuntimeError):
+            target.purge_alarm_history(older_than=30)
+        self.Popen.assert_not_called()
+
+    def test_status_notes_expirer(self):
+        self.patch_object(aodh.AodhCharm, 'coordination_enabled',
+                          return_value=False)
+        self.patch_object(aodh.AodhCharm, 'expirer_enabled',
+                          return_value=True)
+        self.patch_object(aodh.AodhCharm, 'expirer_last_run',
+                          return_value=(12, 125, 'ok'))
+        self.patch_object(aodh.unitdata, 'kv')
+        self.kv.return_value.get.return_value = None
+        target = aodh.AodhCharm()
+        self.assertEqual(target.status_notes(),
+                         ['last expiry: 12s, 125 rows'])
+        self.expirer_last_run.return_value = (3600, 90000, 'stopped')
+        self.assertEqual(target.status_notes(),
+                         ['last expiry: 3600s, 90000 rows (stopped)'])
+
+    def test_measure_worker_rss(self):
+        def process(cmdline, rss):
+            p = mock.MagicMock()
+            p.info = {'cmdline': cmdline,
+                      'memory_info': mock.MagicMock(rss=rss * 2 ** 20)}
+            return p
+        self.patch_object(aodh.psutil, 'process_iter', return_value=[
+            process(['(wsgi:aodh-api)', '', ''], 200),
+            process(['(wsgi:aodh-api)', '', ''], 100),
+            process(['/usr/bin/python3', '/usr/bin/aodh-evaluator'], 90),
+            process(['/usr/bin/python3', '/usr/local/bin/aodh-exporter',
+                     '--evaluator-log=/var/log/aodh/aodh-evaluator.log'],
+                    30),
+            process(['/usr/sbin/apache2', '-k', 'start'], 20),
+            process(None, 10),
+        ])
+        self.assertEqual(aodh.AodhCharm.measure_worker_rss(),
+                         {'api': 200, 'evaluator': 90})
+        self.process_iter.assert_called_once_with(
+            ['cmdline', 'memory_info'])
+
+    def test_update_worker_rss(self):
+        store = {}
+        self.patch_object(aodh.unitdata, 'kv')
+        kv = self.kv.return_value
+        kv.get.side_effect = store.get
+        kv.set.side_effect = store.__setitem__
+        self.patch_object(aodh.time, 'time', return_value=1000)
+        self.patch_object(aodh.AodhCharm, 'measure_worker_rss',
+                          return_value={'api': 150, 'evaluator': 90})
+        target = aodh.AodhCharm()
+        target.config = {'memory-budget': 2048}
+        # the first sample is stored
+        self.assertTrue(target.update_worker_rss())
+        self.assertEqual(store[aodh.WORKER_RSS_KEY],
+                         {'api': 150, 'evaluator': 90})
+        # small workers just after a reload do not shrink the sample
+        self.measure_worker_rss.return_value = {'api': 60, 'evaluator': 40}
+        self.assertFalse(target.update_worker_rss())
+        store[aodh.WORKER_RSS_PEAK_KEY] = {'since': 1000, 'rss': {}}
+        self.assertFalse(target.update_worker_rss())
+        # growth beyond the tolerance raises it straight away
+        self.measure_worker_rss.return_value = {'api': 170, 'evaluator': 95}
+        self.assertTrue(target.update_worker_rss())
+        self.assertEqual(store[aodh.WORKER_RSS_KEY],
+                         {'api': 170, 'evaluator': 95})
+        # a lower high-water mark counts once the workers have settled
+        store[aodh.WORKER_RSS_PEAK_KEY] = {'since': 1000, 'rss': {}}
+        self.measure_worker_rss.return_value = {'api': 120}
+        self.assertFalse(target.update_worker_rss())
+        self.time.return_value = 1000 + aodh.WORKER_RSS_SETTLE
+        self.assertTrue(target.update_worker_rss())
+        self.assertEqual(store[aodh.WORKER_RSS_KEY],
+                         {'api': 120, 'evaluator': 95})
+        target.config = {}
+        self.assertFalse(target.update_worker_rss())
+        kv.unset.assert_has_calls([mock.call(aodh.WORKER_RSS_KEY),
+                                   mock.call(aodh.WORKER_RSS_PEAK_KEY)])
+
+    def test_assess_status_memoized_probes(self):
+        service_running = mock.MagicMock(return_value=True)
+        self.patch_object(aodh.ch_os_utils, 'service_running',
+                          new=service_running)
+
+        def assess_status():
+            for _ in range(3):
+                self.assertTrue(
+                    aodh.ch_os_utils.service_running('aodh-evaluator'))
+            aodh.ch_os_utils.service_running('aodh-notifier')
+
+        self.patch_object(aodh.charms_openstack.charm.HAOpenStackCharm,
+                          'assess_status', side_effect=assess_status)
+        target = aodh.AodhCharm()
+        target.assess_status()
+        self.assertEqual(service_running.call_args_list,
+                         [mock.call('aodh-evaluator'),
+                          mock.call('aodh-notifier')])
+        self.assertIs(aodh.ch_os_utils.service_running, service_running)
+
+    def test_configure_expirer(self):
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=True)
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.ch_host, 'path_hash',
+                          side_effect=[None, 'a', None, 'b'])
+        self.patch_object(aodh.ch_host, 'service')
+        self.patch_object(aodh.ch_host, 'service_restart')
+        self.patch_object(aodh.ch_templating, 'render')
+        self.patch_object(aodh.ch_host, 'write_file')
+        self.patch('subprocess.check_call', name='check_call')
+        self.patch('builtins.open', name='open',
+                   new=mock.mock_open(read_data='wrapper'))
+        target = aodh.AodhCharm()
+        target.config = {
+            'alarm-history-time-to-live': 86400,
+            'alarm-history-expiry-schedule': 'daily',
+            'alarm-history-expiry-window': 600,
+            'alarm-history-delete-batch-size': 500,
+        }
+        target.configure_expirer()
+        self.write_file.assert_called_once_with(
+            aodh.AODH_EXPIRER_RUN, 'wrapper', perms=0o755)
+        context = {'expirer': aodh.AODH_EXPIRER_RUN,
+                   'schedule': 'daily',
+                   'batch_size': 500,
+                   'window': 600}
+        self.render.assert_has_calls([
+            mock.call('aodh-expirer.service', aodh.AODH_EXPIRER_SERVICE,
+                      context, templates_dir='/charm/templates',
+                      perms=0o644),
+            mock.call('aodh-expirer.timer', aodh.AODH_EXPIRER_TIMER,
+                      context, templates_dir='/charm/templates',
+                      perms=0o644),
+        ])
+        self.check_call.assert_called_once_with(
+            ['systemctl', 'daemon-reload'])
+        self.service.assert_called_once_with('enable', 'aodh-expirer.timer')
+        self.service_restart.assert_called_once_with('aodh-expirer.timer')
+
+    def test_configure_expirer_not_leader(self):
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=False)
+        self.patch_object(aodh.os.path, 'exists', return_value=True)
+        self.patch_object(aodh.os, 'remove')
+        self.patch_object(aodh.ch_host, 'service')
+        self.patch_object(aodh.ch_host, 'service_stop')
+        self.patch_object(aodh.ch_templating, 'render')
+        self.patch('subprocess.check_call', name='check_call')
+        target = aodh.AodhCharm()
+        target.config = {'alarm-history-time-to-live': 86400}
+        target.configure_expirer()
+        self.render.assert_not_called()
+        self.service.assert_called_once_with('disable', 'aodh-expirer.timer')
+        self.service_stop.assert_called_once_with('aodh-expirer.timer')
+        self.remove.assert_has_calls([
+            mock.call(aodh.AODH_EXPIRER_SERVICE),
+            mock.call(aodh.AODH_EXPIRER_TIMER),
+            mock.call(aodh.AODH_EXPIRER_RUN),
+            mock.call(aodh.AODH_EXPIRER_LAST_RUN),
+        ])
+
+    def test_configure_exporter(self):
+        self.patch_object(aodh.hookenv, 'relation_ids',
+                          return_value=['metrics-endpoint:1'])
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=True)
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.hookenv, 'open_port')
+        self.patch_object(aodh.hookenv, 'network_get_primary_address',
+                          return_value='10.0.0.10')
+        self.patch_object(aodh.ch_fetch, 'filter_installed_packages',
+                          return_value=['python3-psutil'])
+        self.patch_object(aodh.ch_fetch, 'apt_install')
+        self.patch_object(aodh.ch_host, 'path_hash',
+                          side_effect=[None, None, 'a', 'b'])
+        self.patch_object(aodh.ch_host, 'write_file')
+        self.patch_object(aodh.ch_host, 'service')
+        self.patch_object(aodh.ch_host, 'service_restart')
+        self.patch_object(aodh.ch_templating, 'render')
+        self.patch_object(aodh.AodhCharm, 'publish_scrape_jobs')
+        self.patch_object(aodh.AodhCharm, 'grant_log_access')
+        self.patch('subprocess.check_call', name='check_call')
+        self.patch('builtins.open', name='open',
+                   new=mock.mock_open(read_data='exporter'))
+        target = aodh.AodhCharm()
+        target.config = {'metrics-port': 9650}
+        target.configure_exporter()
+        self.apt_install.assert_called_once_with(['python3-psutil'],
+                                                 fatal=True)
+        self.grant_log_access.assert_has_calls([
+            mock.call('aodh', '/var/log/aodh'),
+            mock.call('aodh', '/var/log/apache2')])
+        self.write_file.assert_called_once_with(
+            aodh.AODH_EXPORTER, 'exporter', perms=0o755)
+        self.render.assert_called_once_with(
+            'aodh-exporter.service', aodh.AODH_EXPORTER_SERVICE,
+            {'exporter': aodh.AODH_EXPORTER, 'address': '10.0.0.10',
+             'port': 9650, 'database': True},
+            templates_dir='/charm/templates', perms=0o644)
+        self.check_call.assert_called_once_with(
+            ['systemctl', 'daemon-reload'])
+        self.service.assert_called_once_with('enable', 'aodh-exporter')
+        self.service_restart.assert_called_once_with('aodh-exporter')
+        self.network_get_primary_address.assert_called_once_with(
+            'metrics-endpoint')
+        self.open_port.assert_called_once_with(9650)
+        self.publish_scrape_jobs.assert_called_once_with()
+
+    def test_configure_exporter_removed(self):
+        self.patch_object(aodh.hookenv, 'relation_ids', return_value=[])
+        self.patch_object(aodh.hookenv, 'close_port')
+        self.patch_object(aodh.os.path, 'exists', return_value=True)
+        self.patch_object(aodh.os, 'remove')
+        self.patch_object(aodh.ch_host, 'service')
+        self.patch_object(aodh.ch_host, 'service_stop')
+        self.patch_object(aodh.ch_templating, 'render')
+        self.patch('subprocess.check_call', name='check_call')
+        target = aodh.AodhCharm()
+        target.config = {'metrics-port': 9650}
+        target.configure_exporter()
+        self.render.assert_not_called()
+        self.service.assert_called_once_with('disable', 'aodh-exporter')
+        self.service_stop.assert_called_once_with('aodh-exporter')
+        self.close_port.assert_called_once_with(9650)
+        self.remove.assert_has_calls([
+            mock.call(aodh.AODH_EXPORTER),
+            mock.call(aodh.AODH_EXPORTER_SERVICE),
+        ])
+
+    def test_publish_scrape_jobs(self):
+        self.patch_object(aodh.hookenv, 'relation_ids',
+                          return_value=['metrics-endpoint:1'])
+        self.patch_object(aodh.hookenv, 'relation_set')
+        self.patch_object(aodh.hookenv, 'is_leader', return_value=True)
+        self.patch_object(aodh.hookenv, 'local_unit', return_value='aodh/0')
+        self.patch_object(aodh.hookenv, 'ingress_address',
+                          return_value='10.0.0.10')
+        self.patch_object(aodh.hookenv, 'model_name', return_value='os')
+        self.patch_object(aodh.hookenv, 'model_uuid', return_value='uuid')
+        self.patch_object(aodh.hookenv, 'application_name',
+                          return_value='aodh')
+        self.patch_object(aodh.hookenv, 'charm_name', return_value='aodh')
+        target = aodh.AodhCharm()
+        target.config = {'metrics-port': 9650}
+        target.publish_scrape_jobs()
+        unit_call, app_call = self.relation_set.call_args_list
+        self.assertEqual(unit_call, mock.call(
+            'metrics-endpoint:1', relation_settings={
+                'prometheus_scrape_unit_address': '10.0.0.10',
+                'prometheus_scrape_unit_name': 'aodh/0',
+            }))
+        settings = app_call[1]['relation_settings']
+        self.assertTrue(app_call[1]['app'])
+        self.assertEqual(json.loads(settings['scrape_jobs']), [{
+            'metrics_path': '/metrics',
+            'static_configs': [{'targets': ['*:9650']}],
+        }])
+        self.assertEqual(json.loads(settings['scrape_metadata'])['unit'],
+                         'aodh/0')
+
+    def test_expirer_last_run(self):
+        last_run = tempfile.NamedTemporaryFile('w', delete=False)
+        self.addCleanup(os.remove, last_run.name)
+        self.patch_object(aodh, 'AODH_EXPIRER_LAST_RUN', new=last_run.name)
+        self.assertIsNone(aodh.AodhCharm.expirer_last_run())
+        with last_run:
+            json.dump({'finished': 1700000000, 'seconds': 12, 'rows': 125,
+                       'status': 'stopped'}, last_run)
+        self.assertEqual(aodh.AodhCharm.expirer_last_run(),
+                         (12, 125, 'stopped'))
+        os.remove(last_run.name)
+        self.assertIsNone(aodh.AodhCharm.expirer_last_run())
+        open(last_run.name, 'w').close()
+
+    def test_render_nrpe_memcached(self):
+        self.patch_object(aodh.nrpe, 'NRPE')
+        self.patch_object(aodh.nrpe, 'add_init_service_checks')
+        self.patch_object(aodh.nrpe, 'copy_nrpe_checks')
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.ch_ip, 'format_ipv6_addr', return_value=None)
+        memcache = mock.MagicMock()
+        memcache.memcache_hosts.return_value = ['10.0.0.1']
+        self.patch_object(aodh.reactive, 'endpoint_from_flag',
+                          return_value=memcache)
+        self.patch_object(aodh.AodhCharm, 'write_nagios_transport_url',
+                          return_value=False)
+        self.patch_object(aodh.AodhCharm, 'grant_log_access')
+        target = aodh.AodhCharmOcata()
+        target.config = {
+            'memcached-hit-rate-warning': 80,
+            'memcached-hit-rate-critical': 50,
+        }
+        target.render_nrpe_checks()
+        self.NRPE.return_value.add_check.assert_any_call(
+            shortname='memcached_hit_rate',
+            description=mock.ANY,
+            check_cmd='/usr/local/lib/nagios/plugins/check_memcached_hit_rate'
+                      ' -s 10.0.0.1:11211 -w 80 -c 50')
+
+    def test_render_nrpe_performance_checks(self):
+        self.patch_object(aodh.nrpe, 'NRPE')
+        self.patch_object(aodh.nrpe, 'add_init_service_checks')
+        self.patch_object(aodh.nrpe, 'copy_nrpe_checks')
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.reactive, 'endpoint_from_flag',
+                          return_value=None)
+        self.patch_object(aodh.AodhCharm, 'local_api_url',
+                          return_value='http://127.0.0.1:8032/')
+        self.patch_object(aodh.AodhCharm, 'write_nagios_transport_url',
+                          return_value=True)
+        self.patch_object(aodh.AodhCharm, 'grant_log_access')
+        target = aodh.AodhCharmOcata()
+        target.config = {
+            'api-response-time-warning': 1.0,
+            'api-response-time-critical': 5.0,
+            'evaluator-lag-warning': 180,
+            'evaluator-lag-critical': 600,
+            'notifier-queue-depth-warning': 100,
+            'notifier-queue-depth-critical': 1000,
+        }
+        target.render_nrpe_checks()
+        add_check = self.NRPE.return_value.add_check
+        add_check.assert_any_call(
+            shortname='aodh_api_response_time',
+            description=mock.ANY,
+            check_cmd='/usr/local/lib/nagios/plugins/'
+                      'check_aodh_api_response_time'
+                      ' -u http://127.0.0.1:8032/ -w 1.0 -c 5.0')
+        add_check.assert_any_call(
+            shortname='aodh_evaluator_lag',
+            description=mock.ANY,
+            check_cmd='/usr/local/lib/nagios/plugins/check_aodh_evaluator_lag'
+                      ' -w 180 -c 600')
+        add_check.assert_any_call(
+            shortname='aodh_notifier_queue_depth',
+            description=mock.ANY,
+            check_cmd='/usr/local/lib/nagios/plugins/check_aodh_queue_depth'
+                      ' -f /etc/nagios/aodh-transport-url'
+                      ' -q alarming.sample -w 100 -c 1000')
+
+    def test_grant_log_access(self):
+        self.patch_object(aodh.ch_host, 'user_exists', return_value=True)
+        self.patch_object(aodh.os.path, 'isdir', return_value=True)
+        self.patch_object(aodh.ch_fetch, 'filter_installed_packages',
+                          side_effect=lambda packages: packages)
+        self.patch_object(aodh.ch_fetch, 'apt_install')
+        self.patch('subprocess.check_call', name='check_call')
+        aodh.AodhCharm.grant_log_access('nagios', '/var/log/aodh')
+        self.apt_install.assert_called_once_with(['acl'], fatal=True)
+        self.user_exists.assert_called_once_with('nagios')
+        self.check_call.assert_has_calls([
+            mock.call(['setfacl', '-R', '-m', 'u:nagios:rX', '/var/log/aodh']),
+            mock.call(['setfacl', '-m', 'd:u:nagios:rX', '/var/log/aodh'])])
+        self.check_call.reset_mock()
+        self.user_exists.return_value = False
+        aodh.AodhCharm.grant_log_access('nagios', '/var/log/aodh')
+        self.check_call.assert_not_called()
+
+    def test_write_nagios_transport_url(self):
+        self.patch_object(aodh.ch_host, 'user_exists', return_value=True)
+        self.patch_object(aodh.ch_host, 'write_file')
+        self.patch_object(aodh, 'ini_sections', return_value={
+            'DEFAULT': {'transport_url': 'rabbit://aodh:pw@10.0.0.1:5672/os'},
+        })
+        target = aodh.AodhCharm()
+        self.assertTrue(target.write_nagios_transport_url())
+        self.write_file.assert_called_once_with(
+            aodh.NAGIOS_TRANSPORT_URL,
+            'rabbit://aodh:pw@10.0.0.1:5672/os\n',
+            owner='root', group='nagios', perms=0o640)
+        # the notification transport is preferred when notification-amqp is
+        # related
+        self.ini_sections.return_value['oslo_messaging_notifications'] = {
+            'transport_url': 'rabbit://aodh:pw@10.0.0.2:5672/notify'}
+        self.assertTrue(target.write_nagios_transport_url())
+        self.write_file.assert_called_with(
+            aodh.NAGIOS_TRANSPORT_URL,
+            'rabbit://aodh:pw@10.0.0.2:5672/notify\n',
+            owner='root', group='nagios', perms=0o640)
+        self.ini_sections.return_value = None
+        self.assertFalse(target.write_nagios_transport_url())
+        self.user_exists.return_value = False
+        self.assertFalse(target.write_nagios_transport_url())
+        self.assertEqual(self.write_file.call_count, 2)
+
 
 class TestAodhCharmOcata(Helper):
 
+    def test_conf_change_services(self):
+        target = aodh.AodhCharmOcata()
+        services = target.services
+        old = {'DEFAULT': {'debug': 'False'},
+               'api': {'workers': '4'},
+               'evaluator': {'workers': '1'}}
+        new = {'DEFAULT': {'debug': 'False'},
+               'api': {'workers': '8'},
+               'evaluator': {'workers': '1'}}
+        self.assertEqual(target.conf_change_services(old, new, services),
+                         ['apache2'])
+        new['evaluator'] = {'workers': '2'}
+        self.assertEqual(target.conf_change_services(old, new, services),
+                         ['aodh-evaluator', 'apache2'])
+        new['DEFAULT'] = {'debug': 'True'}
+        self.assertEqual(target.conf_change_services(old, new, services),
+                         services)
+        self.assertEqual(target.conf_change_services(None, new, services),
+                         services)
+
+    def test_conf_change_services_credentials(self):
+        target = aodh.AodhCharmOcata()
+        old = {'service_credentials': {'region_name': 'RegionOne'}}
+        new = {'service_credentials': {'region_name': 'RegionTwo'}}
+        restarts = target.conf_change_services(old, new, target.services)
+        self.assertIn('apache2', restarts)
+        self.assertIn('aodh-listener', restarts)
+        self.assertEqual(restarts, target.services)
+
+    def test_restart_on_change(self):
+        self.patch_object(aodh.AodhCharmOcata, 'full_restart_map',
+                          new_callable=mock.PropertyMock,
+                          return_value=aodh.AodhCharmOcata.restart_map)
+        hashes = {aodh.AODH_CONF: 'a', aodh.AODH_WSGI_CONF: 'b'}
+        self.patch_object(aodh.ch_host, 'path_hash',
+                          side_effect=lambda path: hashes.get(path))
+        self.patch_object(aodh.AodhCharmOcata, 'daemon_reload')
+        self.patch_object(aodh, 'ini_sections',
+                          side_effect=[{'api': {'workers': '4'}},
+                                       {'api': {'workers': '8'}}])
+        self.patch_object(aodh.ch_os_utils, 'is_unit_paused_set',
+                          return_value=False)
+        self.patch_object(aodh.ch_host, 'service_restart')
+        self.patch_object(aodh.ch_host, 'service_reload')
+        self.patch_object(aodh.unitdata, 'kv')
+        self.patch_object(aodh.AodhCharmOcata, 'cluster_size',
+                          return_value=1)
+        self.patch_object(aodh.AodhCharmOcata, 'wait_for_api')
+        self.kv.return_value.get.return_value = 0
+        target = aodh.AodhCharmOcata()
+        with target.restart_on_change():
+            hashes[aodh.AODH_CONF] = 'c'
+        self.service_reload.assert_called_once_with('apache2')
+        self.service_restart.assert_not_called()
+        self.wait_for_api.assert_called_once_with()
+        self.kv.return_value.set.assert_called_once_with(
+            aodh.RESTARTS_AVOIDED_KEY, 4)
+        self.daemon_reload.assert_not_called()
+
+    def test_restart_on_change_systemd_drop_in(self):
+        self.patch_object(aodh.AodhCharmOcata, 'full_restart_map',
+                          new_callable=mock.PropertyMock,
+                          return_value=aodh.AodhCharmOcata.restart_map)
+        evaluator_conf = aodh.AODH_DAEMON_RESOURCES_CONF.format('evaluator')
+        hashes = {evaluator_conf: None}
+        self.patch_object(aodh.ch_host, 'path_hash',
+                          side_effect=lambda path: hashes.get(path))
+        self.patch_object(aodh, 'ini_sections', return_value={})
+        self.patch_object(aodh.ch_os_utils, 'is_unit_paused_set',
+                          return_value=False)
+        self.patch_object(aodh.AodhCharmOcata, 'daemon_reload')
+        self.patch_object(aodh.AodhCharmOcata, 'restart_services')
+        target = aodh.AodhCharmOcata()
+        with target.restart_on_change():
+            hashes[evaluator_conf] = 'a'
+        self.daemon_reload.assert_called_once_with()
+        self.restart_services.assert_called_once_with(['aodh-evaluator'])
+
+    def test_restart_services_clustered(self):
+        self.patch_object(aodh.AodhCharmOcata, 'cluster_size',
+                          return_value=3)
+        self.patch_object(aodh.AodhCharmOcata, 'perform_restarts')
+        self.patch_object(aodh.reactive, 'set_flag')
+        self.patch_object(aodh.unitdata, 'kv')
+        self.kv.return_value.get.return_value = ['apache2']
+        target = aodh.AodhCharmOcata()
+        target.restart_services(['aodh-evaluator', 'apache2'])
+        self.perform_restarts.assert_not_called()
+        self.kv.return_value.set.assert_called_once_with(
+            aodh.PENDING_RESTARTS_KEY, ['apache2', 'aodh-evaluator'])
+        self.set_flag.assert_called_once_with('aodh.restart.pending')
+
+    def test_restart_services_single_unit(self):
+        self.patch_object(aodh.AodhCharmOcata, 'cluster_size',
+                          return_value=1)
+        self.patch_object(aodh.AodhCharmOcata, 'perform_restarts')
+        self.patch_object(aodh.reactive, 'set_flag')
+        target = aodh.AodhCharmOcata()
+        target.restart_services(['aodh-evaluator'])
+        self.perform_restarts.assert_called_once_with(['aodh-evaluator'])
+        self.set_flag.assert_not_called()
+
+    def test_run_pending_restarts(self):
+        self.patch_object(aodh.AodhCharmOcata, 'perform_restarts')
+        self.patch_object(aodh.ch_os_utils, 'is_unit_paused_set',
+                          return_value=False)
+        self.patch_object(aodh.unitdata, 'kv')
+        self.kv.return_value.get.return_value = ['apache2']
+        target = aodh.AodhCharmOcata()
+        target.run_pending_restarts()
+        self.perform_restarts.assert_called_once_with(['apache2'])
+        self.kv.return_value.unset.assert_called_once_with(
+            aodh.PENDING_RESTARTS_KEY)
+
+    def test_perform_restarts(self):
+        self.patch_object(aodh.ch_host, 'service_restart')
+        self.patch_object(aodh.ch_host, 'service_reload')
+        self.patch_object(aodh.AodhCharmOcata, 'wait_for_api')
+        target = aodh.AodhCharmOcata()
+        target.perform_restarts(['aodh-notifier'])
+        self.service_restart.assert_called_once_with('aodh-notifier')
+        self.wait_for_api.assert_not_called()
+        target.perform_restarts(['apache2'])
+        self.service_reload.assert_called_once_with('apache2')
+        self.wait_for_api.assert_called_once_with()
+
+    def test_wait_for_api(self):
+        self.patch_object(aodh.ch_cluster, 'determine_api_port',
+                          return_value=8032)
+        self.patch_object(aodh.urllib_request, 'urlopen')
+        self.patch_object(aodh.time, 'sleep')
+        self.urlopen.side_effect = [
+            aodh.urllib_request.URLError('refused'),
+            aodh.urllib_request.HTTPError('url', 401, 'auth', {}, None),
+        ]
+        target = aodh.AodhCharmOcata()
+        target.config = {'rolling-restart-api-timeout': 60}
+        self.assertTrue(target.wait_for_api())
+        self.urlopen.assert_called_with('http://127.0.0.1:8032/', timeout=5)
+        self.sleep.assert_called_once_with(2)
+
+    def test_wait_for_api_timeout(self):
+        self.patch_object(aodh.ch_cluster, 'determine_api_port',
+                          return_value=8032)
+        self.patch_object(aodh.urllib_request, 'urlopen',
+                          side_effect=ConnectionRefusedError)
+        self.patch_object(aodh.time, 'sleep')
+        target = aodh.AodhCharmOcata()
+        target.config = {'rolling-restart-api-timeout': 0}
+        self.assertFalse(target.wait_for_api())
+        self.sleep.assert_not_called()
+
     def test_reload_and_restart(self):
         self.patch('subprocess.check_call', name='check_call')
         self.patch_object(aodh.ch_host, 'init_is_systemd', return_value=False)
@@ -166,6 +1423,13 @@ class TestAodhCharmOcata(Helper):
         """Test NRPE renders correctly in Ocata."""
         self.patch_object(aodh.nrpe, 'NRPE')
         self.patch_object(aodh.nrpe, 'add_init_service_checks')
+        self.patch_object(aodh.nrpe, 'copy_nrpe_checks')
+        self.patch_object(aodh.hookenv, 'charm_dir', return_value='/charm')
+        self.patch_object(aodh.reactive, 'endpoint_from_flag',
+                          return_value=None)
+        self.patch_object(aodh.AodhCharm, 'write_nagios_transport_url',
+                          return_value=False)
+        self.patch_object(aodh.AodhCharm, 'grant_log_access')
         services = ['aodh-evaluator', 'aodh-notifier',
                     'aodh-listener', 'apache2']
         target = aodh.AodhCharmOcata()
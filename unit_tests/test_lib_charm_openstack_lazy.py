@@ -0,0 +1,113 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import charm.openstack.lazy as lazy
+
+# Modules that only some hooks need, which must not be loaded when a hook
+# imports the handlers
+DEFERRED = [
+    'charmhelpers.contrib.charmsupport.nrpe',
+    'cProfile',
+    'psutil',
+    'urllib.request',
+]
+
+# Imports the handlers in a fresh interpreter, with charmhelpers mocked as
+# in the unit tests, and prints which of the modules named as arguments were
+# loaded.  A module deferred by lazy_import() sits in sys.modules unloaded
+# until first used, so it is only counted once it has been executed.  nrpe
+# is left to lazy_import() rather than mocked, as an empty module below an
+# empty charmhelpers.contrib.charmsupport package.
+LOADED_PROBE = """
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import json
+import sys
+import types
+from unittest import mock
+
+sys.path.append('src')
+sys.path.append('src/lib')
+
+import charms_openstack.test_mocks
+charms_openstack.test_mocks.mock_charmhelpers()
+sys.modules['charms.coordinator'] = mock.MagicMock()
+
+
+class EmptyModules(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+
+    def find_spec(self, name, path, target=None):
+        if name.startswith('charmhelpers.contrib.charmsupport.'):
+            return importlib.machinery.ModuleSpec(name, self)
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        pass
+
+
+charmsupport = types.ModuleType('charmhelpers.contrib.charmsupport')
+charmsupport.__path__ = []
+sys.modules[charmsupport.__name__] = charmsupport
+sys.meta_path.insert(0, EmptyModules())
+import reactive.aodh_handlers  # noqa
+print(json.dumps([
+    name for name in sys.argv[1:]
+    if name in sys.modules and
+    not isinstance(sys.modules[name], importlib.util._LazyModule)]))
+"""
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        with open(os.path.join(self.path, 'aodh_lazy_probe.py'), 'w') as f:
+            f.write('LOADS = []\nLOADS.append(1)\n')
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+        self.addCleanup(sys.modules.pop, 'aodh_lazy_probe', None)
+
+    def test_lazy_import(self):
+        module = lazy.lazy_import('aodh_lazy_probe')
+        self.assertIs(sys.modules['aodh_lazy_probe'], module)
+        # nothing has been executed until an attribute is used
+        self.assertNotIn('LOADS', object.__getattribute__(module, '__dict__'))
+        self.assertEqual(module.LOADS, [1])
+        self.assertIs(lazy.lazy_import('aodh_lazy_probe'), module)
+
+    def test_lazy_import_missing(self):
+        with self.assertRaises(ImportError):
+            lazy.lazy_import('aodh_lazy_probe_missing')
+
+
+class TestHookStartup(unittest.TestCase):
+
+    def test_handlers_import_defers_modules(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = json.loads(subprocess.check_output(
+            [sys.executable, '-c', LOADED_PROBE] + DEFERRED, cwd=root,
+            universal_newlines=True))
+        self.assertEqual(loaded, [])
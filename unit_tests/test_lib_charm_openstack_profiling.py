@@ -0,0 +1,124 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import inspect
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import charm.openstack.aodh as aodh
+import charm.openstack.profiling as profiling
+
+import charms_openstack.test_utils as test_utils
+
+
+class TestProfiling(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.options = {'hook-profiling': True}
+        self.patch_object(profiling.hookenv, 'config',
+                          side_effect=lambda key: self.options.get(key))
+        self.patch_object(profiling.hookenv, 'charm_dir',
+                          return_value=self.charm_dir)
+        self.patch_object(profiling.hookenv, 'hook_name',
+                          return_value='update-status')
+        self.patch_object(profiling.hookenv, 'atexit')
+        self.patch_object(profiling, '_records', new=[])
+        self.patch_object(profiling, '_flush_scheduled', new=False)
+
+    def test_timed_disabled(self):
+        self.options['hook-profiling'] = False
+        func = profiling.timed(lambda: 'result')
+        self.assertEqual(func(), 'result')
+        self.assertEqual(profiling._records, [])
+        self.atexit.assert_not_called()
+
+    def test_timed(self):
+        @profiling.timed
+        def render():
+            return 'result'
+
+        self.assertEqual(render(), 'result')
+        self.assertEqual(len(profiling._records), 1)
+        name, seconds = profiling._records[0]
+        self.assertTrue(name.endswith('.render'))
+        self.atexit.assert_called_once_with(profiling.flush)
+
+    def test_timed_cprofile(self):
+        self.options['hook-profiling-cprofile'] = True
+        profiling.timed(lambda: None)()
+        self.assertEqual(
+            len([f for f in os.listdir(os.path.join(self.charm_dir,
+                                                    profiling.PROFILE_DIR))
+                 if f.endswith('.prof')]),
+            1)
+
+    def test_flush_and_slowest(self):
+        self.patch_object(profiling, 'MAX_HOOKS', new=2)
+        for timings in ([['a', 1.0], ['b', 3.0]],
+                        [['a', 2.0]],
+                        [['a', 5.0], ['b', 1.0]]):
+            profiling._records = timings
+            profiling.flush()
+        path = os.path.join(self.charm_dir, profiling.PROFILE_DIR,
+                            profiling.PROFILE_LOG)
+        with open(path) as f:
+            hooks = [json.loads(line) for line in f]
+        self.assertEqual(len(hooks), 2)
+        self.assertEqual(hooks[0]['hook'], 'update-status')
+        self.assertEqual(profiling.slowest(), [
+            {'name': 'a', 'calls': 2, 'total': 7.0, 'max': 5.0,
+             'mean': 3.5},
+            {'name': 'b', 'calls': 1, 'total': 1.0, 'max': 1.0,
+             'mean': 1.0},
+        ])
+        self.assertEqual(len(profiling.slowest(1)), 1)
+
+    def test_instrument_handlers(self):
+        handler_class = mock.MagicMock()
+        invoke = mock.MagicMock(return_value='invoked', profiled=False)
+        handler_class.invoke = invoke
+        self.patch_object(profiling.reactive_bus, 'Handler',
+                          new=handler_class)
+        profiling.instrument_handlers()
+        self.atexit.assert_called_once_with(profiling.flush)
+        handler = mock.MagicMock()
+        handler.id.return_value = 'aodh_handlers.py:10:render'
+        self.assertEqual(handler_class.invoke(handler), 'invoked')
+        invoke.assert_called_once_with(handler)
+        self.assertEqual(profiling._records[0][0],
+                         'handler:aodh_handlers.py:10:render')
+        # instrumenting again does not wrap twice
+        wrapped = handler_class.invoke
+        profiling.instrument_handlers()
+        self.assertIs(handler_class.invoke, wrapped)
+        self.atexit.assert_called_once_with(profiling.flush)
+
+    def test_aodh_entry_points_timed(self):
+        # Every module level function handing off to the charm singleton
+        entry_points = [
+            func for name, func in inspect.getmembers(aodh,
+                                                      inspect.isfunction)
+            if (func.__module__ == aodh.__name__ and
+                'AodhCharm.singleton' in inspect.getsource(func))]
+        self.assertIn(aodh.purge_alarm_history, entry_points)
+        self.assertEqual(
+            [func.__name__ for func in entry_points
+             if not hasattr(func, '__wrapped__')],
+            [])